@@ -2,8 +2,11 @@
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler
-from config import BOTS
-from database import add_corporate_user
+from config import BOTS, ADMIN_ID
+from database import add_corporate_user, warm_corporate_users, get_broadcasts, close_pool
+import broadcast
+import media
+import throttle
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -45,26 +48,83 @@ async def start(update: Update, context):
     user = update.effective_user
     name = user.first_name or user.username or "Пользователь"
     
-    add_corporate_user(user.id, user.username, user.first_name)
+    await add_corporate_user(user.id, user.username, user.first_name)
     
     message = f"👋 Привет, {name}!\n🤖 Я - бот Dark Heavens Corporate! 🌌\n\nВсе разработки ниже от @haker_one."
     
-    await context.bot.send_photo(
-        chat_id=update.effective_chat.id,
-        photo=IMAGE_URL,
-        caption=message,
-        reply_markup=InlineKeyboardMarkup(KEYBOARD)
-    )
+    try:
+        await media.send_photo(
+            context.bot, update.effective_chat.id, IMAGE_URL,
+            caption=message,
+            reply_markup=InlineKeyboardMarkup(KEYBOARD)
+        )
+    except Exception as e:
+        logger.warning(f"⚠️ /start без картинки: {e}")
+        await update.message.reply_text(message, reply_markup=InlineKeyboardMarkup(KEYBOARD))
+
+
+async def broadcast_command(update: Update, context):
+    """/broadcast <текст> — рассылка всем пользователям бота"""
+    if update.effective_user.id != ADMIN_ID:
+        return
+    text = update.message.text.partition(" ")[2].strip()
+    if not text:
+        await update.message.reply_text("Использование: /broadcast <текст>")
+        return
+    broadcast_id, total = await broadcast.start(context.bot, text, ADMIN_ID)
+    await update.message.reply_text(f"📣 Рассылка #{broadcast_id} запущена: {total} получателей")
+
+
+async def broadcast_status(update: Update, context):
+    if update.effective_user.id != ADMIN_ID:
+        return
+    rows = await get_broadcasts(5)
+    if not rows:
+        await update.message.reply_text("Рассылок ещё не было")
+        return
+    lines = [
+        f"#{b['id']} {b['status']}: {b['sent']}/{b['total']} доставлено, "
+        f"{b['blocked']} заблокировали, {b['failed']} ошибок"
+        for b in rows
+    ]
+    await update.message.reply_text("📣 Рассылки:\n" + "\n".join(lines))
+
+
+async def broadcast_cancel(update: Update, context):
+    if update.effective_user.id != ADMIN_ID:
+        return
+    if not context.args or not context.args[0].isdigit():
+        await update.message.reply_text("Использование: /broadcast_cancel <id>")
+        return
+    await broadcast.cancel(int(context.args[0]))
+    await update.message.reply_text(f"⏹ Рассылка #{context.args[0]} остановлена")
+
+
+async def post_init(app):
+    """Прогреть список пользователей и продолжить рассылки, прерванные перезапуском"""
+    logger.info(f"✅ Пользователей corporate бота в памяти: {await warm_corporate_users()}")
+    await broadcast.resume(app.bot)
+
+
+async def post_stop(app):
+    await broadcast.stop()
 
 
 def register_handlers(app):
     """Регистрация хендлеров"""
+    throttle.install(app, BOT_NAME)
     app.add_handler(CommandHandler('start', start))
+    app.add_handler(CommandHandler('broadcast', broadcast_command))
+    app.add_handler(CommandHandler('broadcast_status', broadcast_status))
+    app.add_handler(CommandHandler('broadcast_cancel', broadcast_cancel))
 
 
 def main():
     """Для автономного запуска"""
-    app = Application.builder().token(BOTS[BOT_NAME]).build()
+    app = (
+        Application.builder().token(BOTS[BOT_NAME])
+        .post_init(post_init).post_stop(post_stop).post_shutdown(close_pool).build()
+    )
     register_handlers(app)
     logger.info("Corporate bot запущен")
     app.run_polling(allowed_updates=Update.ALL_TYPES)
@@ -1,29 +1,59 @@
 """SR Link - сокращатель и раскрыватель ссылок"""
 import logging
-import requests
 from uuid import uuid4
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, InlineQueryHandler, filters
 from config import BOTS
-from database import add_shortened_link, get_user_links_count
+from database import add_shortened_link, get_user_links_count, close_pool
+from http_client import get as http_get, close_http_client
+import shortener
+import media
+import throttle
+from inline import SingleFlight, Debouncer, SUPERSEDED, answer
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+IMAGE_URL = "https://www.darkheavens.ru/cec89b42919ff8b77a477b35d71a1a17.jpg"
 BOT_NAME = "link_shortener"
 
+debouncer = Debouncer()
+flight = SingleFlight()
 
-def shorten_url(long_url):
+
+async def shorten_clck(long_url):
     """Сокращаем ссылку через clck.ru"""
+    resp = await http_get('https://clck.ru/--', params={'url': long_url})
+    resp.raise_for_status()
+    return resp.text.strip()
+
+
+async def shorten_url(long_url, user_id):
+    """Сокращаем ссылку собственным движком, если он включён, иначе через clck.ru.
+    Повторные запросы того же (нормализованного) URL отдаются из кэша без внешних вызовов,
+    одновременные — выполняются одним запросом. Нормализованный URL — только ключ:
+    сокращается и сохраняется ссылка в том виде, в каком её прислали."""
     try:
-        resp = requests.get('https://clck.ru/--', params={'url': long_url}, timeout=5)
-        resp.raise_for_status()
-        return resp.text.strip()
+        normalized = shortener.normalize_url(long_url)
+        shortened = await shortener.lookup_shortened(normalized)
+        if shortened:
+            return shortened
+        return await flight.do(normalized, lambda: _shorten_new(long_url, normalized, user_id))
     except Exception as e:
         logger.error(f"Ошибка сокращения URL: {e}")
         return None
 
 
+async def _shorten_new(long_url, normalized, user_id):
+    if shortener.enabled():
+        shortened = await shortener.create_short_link(user_id, long_url, normalized)
+    else:
+        shortened = await shorten_clck(long_url)
+        await add_shortened_link(user_id, long_url, shortened.split('/')[-1], normalized)
+    shortener.remember_shortened(normalized, shortened)
+    return shortened
+
+
 def is_valid_url(url):
     """Проверка валидности URL"""
     return url.startswith(('http://', 'https://')) and ' ' not in url
@@ -40,10 +70,7 @@ async def start(update: Update, context):
         "Просто отправь мне URL!"
     )
     try:
-        await update.message.reply_photo(
-            photo="https://www.darkheavens.ru/cec89b42919ff8b77a477b35d71a1a17.jpg",
-            caption=text
-        )
+        await media.send_photo(context.bot, update.effective_chat.id, IMAGE_URL, caption=text)
     except:
         await update.message.reply_text(text)
 
@@ -70,16 +97,15 @@ async def callback_handler(update: Update, context):
     
     if action == "unshort":
         try:
-            resp = requests.get(link, allow_redirects=False, timeout=5)
+            resp = await http_get(link)
             expanded = resp.headers.get('Location', link)
             await query.edit_message_text(f"Раскрытый URL:\n{expanded}")
         except Exception as e:
             await query.edit_message_text(f"⚠️ Не удалось раскрыть URL: {e}")
     
     elif action == "short":
-        shortened = shorten_url(link)
+        shortened = await shorten_url(link, update.effective_user.id)
         if shortened:
-            add_shortened_link(update.effective_user.id, link, shortened.split('/')[-1])
             await query.edit_message_text(f"Сокращенный URL:\n{shortened}")
         else:
             await query.edit_message_text("⚠️ Не удалось сократить URL")
@@ -95,10 +121,13 @@ async def inline_query(update: Update, context):
             'input_message_content': {'message_text': "Введите валидный URL"},
             'description': "URL должен начинаться с http:// или https://"
         }]
-        await update.answer(results)
+        await answer(update.inline_query, results, hint=True)
         return
     
-    shortened = shorten_url(link)
+    # Telegram шлёт запрос на каждое нажатие — сокращаем только последний вариант ссылки
+    shortened = await debouncer.run(update.effective_user.id, lambda: shorten_url(link, update.effective_user.id))
+    if shortened is SUPERSEDED:
+        return
     results = [
         {
             'type': 'article', 'id': uuid4().hex,
@@ -113,20 +142,26 @@ async def inline_query(update: Update, context):
             'description': "Нажмите для раскрытия"
         }
     ]
-    await update.answer(results)
+    await answer(update.inline_query, results, cache_time=None if shortened else 10)
+
+
+async def post_shutdown(app):
+    await close_http_client()
+    await close_pool()
 
 
 def register_handlers(app):
     """Регистрация хендлеров"""
+    throttle.install(app, BOT_NAME)
     app.add_handler(CommandHandler('start', start))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     app.add_handler(CallbackQueryHandler(callback_handler))
-    app.add_handler(InlineQueryHandler(inline_query))
+    app.add_handler(InlineQueryHandler(inline_query, block=False))
 
 
 def main():
     """Для автономного запуска"""
-    app = Application.builder().token(BOTS[BOT_NAME]).build()
+    app = Application.builder().token(BOTS[BOT_NAME]).post_shutdown(post_shutdown).build()
     register_handlers(app)
     logger.info("Link Shortener bot запущен")
     app.run_polling(allowed_updates=Update.ALL_TYPES)
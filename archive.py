@@ -0,0 +1,101 @@
+"""Архив support бота: пакетный перенос решённых тикетов и обслуживание месячных разделов support_archive.
+
+Перенос запускается из support бота (post_init). Выгрузка и отсоединение старых разделов — из командной строки:
+    python archive.py list
+    python archive.py export 2025-01 [--format jsonl] [--output support_archive_2025_01.csv.gz]
+    python archive.py detach 2025-01 [--drop]
+"""
+import argparse
+import asyncio
+import gzip
+import logging
+import re
+from config import ARCHIVE_INTERVAL, ARCHIVE_BATCH
+from database import (
+    archive_resolved_tickets, get_archive_partitions, copy_archive_partition, detach_archive_partition,
+    open_pool, close_pool
+)
+
+logger = logging.getLogger(__name__)
+
+_task = None
+
+
+async def archive_forever():
+    """Переносить решённые тикеты пачками по ARCHIVE_BATCH раз в ARCHIVE_INTERVAL"""
+    while True:
+        try:
+            moved = await archive_resolved_tickets(ARCHIVE_BATCH)
+            while moved == ARCHIVE_BATCH:
+                moved = await archive_resolved_tickets(ARCHIVE_BATCH)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Перенос тикетов в архив: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL)
+
+
+def start():
+    global _task
+    if _task is None or _task.done():
+        _task = asyncio.create_task(archive_forever())
+
+
+async def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        await asyncio.gather(_task, return_exceptions=True)
+        _task = None
+
+
+def partition_name(month):
+    """'2025-01' -> 'support_archive_2025_01'"""
+    if not re.fullmatch(r"\d{4}-\d{2}", month):
+        raise argparse.ArgumentTypeError("месяц в формате ГГГГ-ММ")
+    return "support_archive_" + month.replace("-", "_")
+
+
+async def export(name, fmt, output):
+    """Потоковая выгрузка раздела в gzip: память не зависит от размера раздела"""
+    rows = 0
+    with gzip.open(output, "wb") as f:
+        async for data in copy_archive_partition(name, fmt):
+            f.write(data)
+            rows += 1
+    logger.info(f"✅ {name} выгружен в {output}" + (f" ({rows} строк)" if fmt == "jsonl" else ""))
+
+
+async def main_async(args):
+    await open_pool()
+    try:
+        if args.command == "list":
+            for name, bound, rows in await get_archive_partitions():
+                print(f"{name}\t{bound}\t~{max(rows, 0)}")
+        elif args.command == "export":
+            output = args.output or f"{args.partition}.{args.format}.gz"
+            await export(args.partition, args.format, output)
+        elif args.command == "detach":
+            await detach_archive_partition(args.partition, drop=args.drop)
+            logger.info(f"✅ {args.partition} отсоединён" + (" и удалён" if args.drop else ""))
+    finally:
+        await close_pool()
+
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Разделы support_archive")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="разделы и примерное число строк")
+    export_parser = commands.add_parser("export", help="выгрузить месяц в .csv.gz или .jsonl.gz")
+    export_parser.add_argument("partition", type=partition_name, metavar="ГГГГ-ММ")
+    export_parser.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+    export_parser.add_argument("--output")
+    detach_parser = commands.add_parser("detach", help="отсоединить месяц от support_archive")
+    detach_parser.add_argument("partition", type=partition_name, metavar="ГГГГ-ММ")
+    detach_parser.add_argument("--drop", action="store_true", help="и удалить таблицу (после export)")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,389 @@
+"""Нагрузочный бенчмарк database.py на одноразовой БД.
+
+Для каждого объёма данных база очищается и заполняется заново, затем каждая функция гоняется
+при нескольких уровнях параллелизма. Результат — ops/s и p50/p95/p99, сохраняется в JSON
+и сравнивается с предыдущим запуском (регрессии выделяются).
+
+    python bench_database.py --dsn postgresql://postgres@localhost/postgres
+    python bench_database.py --sizes 1k,100k,10M --concurrency 1,8,32 --duration 10
+
+Без --dsn запускается временный кластер (initdb/pg_ctl из PATH или PG_BIN). С --dsn на сервере
+создаётся и после удаляется отдельная база bench_<pid>, рабочие данные не затрагиваются.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+import psycopg
+from psycopg.conninfo import make_conninfo
+
+RESULTS_DIR = Path(__file__).with_name("bench_results")
+SIZE_SUFFIXES = {"k": 1_000, "m": 1_000_000}
+# Функции, читающие таблицу целиком: на больших объёмах замер бессмыслен
+FULL_SCAN_LIMIT = 100_000
+
+WORDS = [
+    "оплата", "доступ", "ошибка", "пароль", "бот", "ссылка", "заказ", "аккаунт", "вход", "сообщение",
+    "возврат", "подписка", "телефон", "уведомление", "настройки", "профиль", "карта", "вывод", "баланс", "кнопка",
+]
+PRIORITIES = ["Низкий", "Средний", "Высокий"]
+
+
+def parse_size(text):
+    """'100k' -> 100000, '10M' -> 10000000"""
+    text = text.strip().lower()
+    if text[-1] in SIZE_SUFFIXES:
+        return int(float(text[:-1]) * SIZE_SUFFIXES[text[-1]])
+    return int(text)
+
+
+def format_size(n):
+    for suffix, factor in (("M", 1_000_000), ("k", 1_000)):
+        if n >= factor and n % factor == 0:
+            return f"{n // factor}{suffix}"
+    return str(n)
+
+
+# Одноразовый Postgres
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _pg_tool(name):
+    path = shutil.which(name, path=os.getenv("PG_BIN")) if os.getenv("PG_BIN") else shutil.which(name)
+    if not path:
+        sys.exit(f"❌ {name} не найден: укажите --dsn или каталог с бинарниками Postgres в PG_BIN")
+    return path
+
+
+class TempCluster:
+    """initdb во временном каталоге, сервер только на unix-сокете"""
+
+    def __init__(self):
+        self.dir = tempfile.mkdtemp(prefix="bench-pg-")
+        self.data = os.path.join(self.dir, "data")
+        self.port = _free_port()
+
+    def start(self):
+        subprocess.run(
+            [_pg_tool("initdb"), "-D", self.data, "-U", "postgres", "-A", "trust", "-E", "UTF8", "--no-sync"],
+            check=True, stdout=subprocess.DEVNULL
+        )
+        options = f"-p {self.port} -k {self.dir} -c listen_addresses='' -c fsync=off -c max_connections=200"
+        subprocess.run(
+            [_pg_tool("pg_ctl"), "-D", self.data, "-o", options, "-l", os.path.join(self.dir, "log"), "-w", "start"],
+            check=True, stdout=subprocess.DEVNULL
+        )
+        return f"postgresql://postgres@/postgres?host={self.dir}&port={self.port}"
+
+    def stop(self):
+        subprocess.run([_pg_tool("pg_ctl"), "-D", self.data, "-m", "immediate", "stop"], stdout=subprocess.DEVNULL)
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+# Заполнение данными
+TABLES = (
+    "corporate_users", "uid_requests", "shortened_links", "support_tickets", "support_archive",
+    "support_daily_stats", "user_counters", "global_counters"
+)
+
+
+async def seed(db, n):
+    """n строк в каждой таблице ботов; счётчики и агрегаты заполняют триггеры, как в работе"""
+    users = max(n // 10, 1)
+    async with db.connection() as conn:
+        await conn.execute(f"TRUNCATE {', '.join(TABLES)} RESTART IDENTITY")
+        await conn.execute("ALTER SEQUENCE ticket_id_seq RESTART WITH 1")
+        await conn.execute("""
+            INSERT INTO corporate_users (user_id, username, first_name)
+            SELECT g, 'user' || g, 'Имя ' || g FROM generate_series(1, %(n)s) g
+        """, {"n": n})
+        await conn.execute("""
+            INSERT INTO uid_requests (user_id, target_username, target_id, created_at)
+            SELECT 1 + g %% %(users)s, 'user' || (g %% 50000), g, LOCALTIMESTAMP - (g %% 86400) * INTERVAL '1 second'
+            FROM generate_series(1, %(n)s) g
+        """, {"n": n, "users": users})
+        # url_hash считается в Python (как при записи ботом), поэтому COPY, а не generate_series
+        async with conn.cursor().copy(
+            "COPY shortened_links (user_id, original_url, short_code, is_local, url_hash) FROM STDIN"
+        ) as copy:
+            for i in range(1, n + 1):
+                url = f"https://example.com/page/{i}"
+                await copy.write_row((1 + i % users, url, f"c{i}", i % 2 == 0, db.url_hash(url)))
+        words = "ARRAY[" + ", ".join(f"'{w}'" for w in WORDS) + "]"
+        priorities = "ARRAY[" + ", ".join(f"'{p}'" for p in PRIORITIES) + "]"
+        message = f"""format('%%s не работает, %%s и %%s', w[1 + g %% 20], w[1 + (g / 20) %% 20], w[1 + (g / 400) %% 20])"""
+        await conn.execute(f"""
+            INSERT INTO support_tickets (user_id, username, first_name, last_name, message, priority, created_at)
+            SELECT 1 + g %% %(users)s, 'user' || g, 'Имя', '', {message}, p[1 + g %% 3],
+                   LOCALTIMESTAMP - (g %% 2592000) * INTERVAL '1 second'
+            FROM generate_series(1, %(n)s) g, (SELECT {words} AS w, {priorities} AS p) v
+        """, {"n": n, "users": users})
+        await conn.execute("""
+            SELECT ensure_support_archive_partition(date_trunc('month', LOCALTIMESTAMP) - m * INTERVAL '1 month')
+            FROM generate_series(0, 12) m
+        """)
+        await conn.execute(f"""
+            INSERT INTO support_archive (ticket_id, user_id, username, message, priority, status, rating, created_at, resolution_date)
+            SELECT 'a' || g, 1 + g %% %(users)s, 'user' || g, {message}, p[1 + g %% 3], 'Решено',
+                   CASE WHEN g %% 3 = 0 THEN 1 + g %% 5 END,
+                   LOCALTIMESTAMP - (g %% 31536000) * INTERVAL '1 second' - INTERVAL '1 hour',
+                   LOCALTIMESTAMP - (g %% 31536000) * INTERVAL '1 second'
+            FROM generate_series(1, %(n)s) g, (SELECT {words} AS w, {priorities} AS p) v
+        """, {"n": n, "users": users})
+    # VACUUM не выполняется в транзакции
+    async with await psycopg.AsyncConnection.connect(db.DATABASE_URL, autocommit=True) as conn:
+        await conn.execute("VACUUM ANALYZE")
+
+
+# Сценарии
+def cases(db, n):
+    """Имя -> фабрика корутины одной операции (номер операции на входе)"""
+    rnd = random.Random(42)
+    users = max(n // 10, 1)
+    next_ticket = iter(range(1, n + 1))
+    batch_size = db.WRITE_BUFFER_BATCH
+
+    def user():
+        return rnd.randint(1, users)
+
+    def ticket():
+        return str(rnd.randint(1, n))
+
+    def word():
+        return rnd.choice(WORDS)
+
+    def cold(key, call):
+        """Счётчики кэшируются на COUNTER_CACHE_TTL: сброс ключа, чтобы замерить сам запрос"""
+        db._counter_cache.set(key, None)
+        return call()
+
+    def batch(row):
+        return lambda i: [row(i * batch_size + k) for k in range(batch_size)]
+
+    uid_rows = batch(lambda k: (user(), f"user{k}", k))
+    link_rows = batch(lambda k: (user(), f"https://example.org/{k}", f"x{k}", db.url_hash(f"https://example.org/{k}")))
+    corporate_rows = batch(lambda k: (n + k + 1, f"new{k}", "Имя"))
+
+    result = {
+        "create_ticket": lambda i: db.create_ticket(user(), "u", "Имя", "", f"{word()} и {word()}", rnd.choice(PRIORITIES)),
+        "get_ticket": lambda i: db.get_ticket(ticket()),
+        "update_ticket_status": lambda i: db.update_ticket_status(ticket(), "В обработке", 1),
+        "add_ticket_note": lambda i: db.add_ticket_note(ticket(), f"заметка {word()}"),
+        "resolve_ticket": lambda i: db.resolve_ticket(str(next(next_ticket, 1))),
+        "archive_resolved_tickets": lambda i: db.archive_resolved_tickets(100),
+        "get_tickets_page": lambda i: db.get_tickets_page(5),
+        "get_tickets_page(filter)": lambda i: db.get_tickets_page(5, status="Новый", priority="Высокий"),
+        "search_tickets": lambda i: db.search_tickets(f"{word()} {word()}", 5),
+        "get_stats": lambda i: db.get_stats(),
+        "get_support_rollup": lambda i: db.get_support_rollup(30),
+        "get_backlog": lambda i: db.get_backlog(),
+        "get_user_requests_count": lambda i: db.get_user_requests_count(user()),
+        "get_user_links_count": lambda i: db.get_user_links_count(user()),
+        "get_stats (cold)": lambda i: cold("tickets_resolved", db.get_stats),
+        "get_user_requests_count (cold)": lambda i: (
+            lambda u: cold(("uid_info", u), lambda: db.get_user_requests_count(u)))(user()),
+        "get_user_links_count (cold)": lambda i: (
+            lambda u: cold(("link_shortener", u), lambda: db.get_user_links_count(u)))(user()),
+        "get_recent_resolutions": lambda i: db.get_recent_resolutions(86400, 1000),
+        "find_shortened_link": lambda i: db.find_shortened_link(f"https://example.com/page/{rnd.randint(1, n)}"),
+        "get_local_link": lambda i: db.get_local_link(f"c{2 * rnd.randint(1, max(n // 2, 1))}"),
+        "allocate_short_ids": lambda i: db.allocate_short_ids(100),
+        "add_local_link": lambda i: db.add_local_link(user(), f"https://example.net/{i}", f"l{i}-{rnd.random()}"),
+        # Буферизованные add_* сами по себе только ставят строку в очередь; в БД пишет сброс пачки
+        f"add_uid_request (flush {batch_size})": lambda i: db._flush_uid_requests(uid_rows(i)),
+        f"add_shortened_link (flush {batch_size})": lambda i: db._flush_shortened_links(link_rows(i)),
+        f"add_corporate_user (flush {batch_size})": lambda i: db._flush_corporate_users(corporate_rows(i)),
+    }
+    if n <= FULL_SCAN_LIMIT:
+        result["get_all_tickets"] = lambda i: db.get_all_tickets()
+    return result
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+async def measure(op, concurrency, duration, max_ops):
+    """concurrency исполнителей вызывают op, пока не истечёт duration или не наберётся max_ops"""
+    latencies = []
+    errors = 0
+    counter = iter(range(max_ops))
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            if time.perf_counter() >= deadline:
+                return
+            start = time.perf_counter()
+            try:
+                await op(i)
+            except Exception:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "ops": len(latencies),
+        "errors": errors,
+        "ops_per_sec": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+# Сравнение с предыдущим запуском
+def latest_result(exclude=None):
+    files = sorted(p for p in RESULTS_DIR.glob("*.json") if p != exclude)
+    return files[-1] if files else None
+
+
+def compare(current, previous, threshold):
+    """Строки таблицы сравнения; регрессия — падение ops/s или рост p95 больше threshold"""
+    before = {(r["size"], r["case"], r["concurrency"]): r for r in previous["results"]}
+    lines, regressions = [], 0
+    for r in current["results"]:
+        old = before.get((r["size"], r["case"], r["concurrency"]))
+        if not old or not old["ops_per_sec"]:
+            continue
+        speed = r["ops_per_sec"] / old["ops_per_sec"] - 1
+        p95 = r["p95_ms"] / old["p95_ms"] - 1 if old["p95_ms"] else 0.0
+        flag = "❌" if speed < -threshold or p95 > threshold else ("✅" if speed > threshold else "  ")
+        regressions += flag == "❌"
+        lines.append(
+            f"{flag} {format_size(r['size']):>5} {r['case']:<40} c={r['concurrency']:<3} "
+            f"ops/s {speed:+7.1%}  p95 {p95:+7.1%}"
+        )
+    return lines, regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=Path(__file__).parent
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+async def run(args, dsn):
+    # config.py читает DATABASE_URL при импорте, поэтому database импортируется после выбора базы
+    os.environ["DATABASE_URL"] = dsn
+    import database as db
+
+    await db.open_pool()
+    await db.init_db()
+    selected = set(args.cases.split(",")) if args.cases else None
+    results = []
+    try:
+        for n in map(parse_size, args.sizes.split(",")):
+            print(f"🌱 Заполнение: {format_size(n)} строк на таблицу...", flush=True)
+            started = time.perf_counter()
+            await seed(db, n)
+            print(f"   готово за {time.perf_counter() - started:.1f} с", flush=True)
+            for name, op in cases(db, n).items():
+                if selected and name.split(" ")[0] not in selected:
+                    continue
+                for concurrency in map(int, args.concurrency.split(",")):
+                    stats = await measure(op, concurrency, args.duration, args.max_ops)
+                    results.append({"size": n, "case": name, "concurrency": concurrency, **stats})
+                    print(
+                        f"{format_size(n):>5} {name:<40} c={concurrency:<3} {stats['ops_per_sec']:>10.1f} ops/s  "
+                        f"p50 {stats['p50_ms']:>8.2f}  p95 {stats['p95_ms']:>8.2f}  p99 {stats['p99_ms']:>8.2f} мс"
+                        + (f"  ошибок {stats['errors']}" if stats["errors"] else ""),
+                        flush=True
+                    )
+        async with db.connection() as conn:
+            server = (await (await conn.execute("SHOW server_version")).fetchone())[0]
+    finally:
+        await db.close_pool()
+    return {
+        "meta": {
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "postgres": server,
+            "pool_max_size": db.DB_POOL_MAX_SIZE,
+            "duration": args.duration,
+        },
+        "results": results,
+    }
+
+
+async def create_database(admin_dsn, name):
+    async with await psycopg.AsyncConnection.connect(admin_dsn, autocommit=True) as conn:
+        await conn.execute(f'DROP DATABASE IF EXISTS "{name}"')
+        await conn.execute(f'CREATE DATABASE "{name}" ENCODING \'UTF8\' TEMPLATE template0')
+
+
+async def drop_database(admin_dsn, name):
+    async with await psycopg.AsyncConnection.connect(admin_dsn, autocommit=True) as conn:
+        await conn.execute(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк функций database.py")
+    parser.add_argument("--dsn", help="сервер Postgres; по умолчанию — временный кластер initdb")
+    parser.add_argument("--sizes", default="1k,100k", help="строк на таблицу, например 1k,100k,10M")
+    parser.add_argument("--concurrency", default="1,8,32", help="одновременных вызовов")
+    parser.add_argument("--duration", type=float, default=3, help="секунд на замер")
+    parser.add_argument("--max-ops", type=int, default=100_000, help="предел операций на замер")
+    parser.add_argument("--cases", help="только эти функции, через запятую")
+    parser.add_argument("--output", type=Path, help=f"файл результата (по умолчанию {RESULTS_DIR.name}/<время>.json)")
+    parser.add_argument("--compare", type=Path, help="с чем сравнить (по умолчанию — последний результат)")
+    parser.add_argument("--threshold", type=float, default=0.2, help="допуск регрессии, доля")
+    args = parser.parse_args()
+
+    cluster = None
+    if args.dsn:
+        admin_dsn = args.dsn
+    else:
+        cluster = TempCluster()
+        admin_dsn = cluster.start()
+    name = f"bench_{os.getpid()}"
+    try:
+        asyncio.run(create_database(admin_dsn, name))
+        report = asyncio.run(run(args, make_conninfo(admin_dsn, dbname=name)))
+    finally:
+        try:
+            asyncio.run(drop_database(admin_dsn, name))
+        finally:
+            if cluster:
+                cluster.stop()
+
+    output = args.output or RESULTS_DIR / f"{datetime.now():%Y%m%d-%H%M%S}.json"
+    previous = args.compare or latest_result(exclude=output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, ensure_ascii=False, indent=2))
+    print(f"💾 {output}")
+    if previous and previous.exists():
+        lines, regressions = compare(report, json.loads(previous.read_text()), args.threshold)
+        print(f"\nСравнение с {previous}:")
+        print("\n".join(lines))
+        if regressions:
+            print(f"❌ Регрессий: {regressions}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
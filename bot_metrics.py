@@ -0,0 +1,66 @@
+"""Метрики ботов: апдейты, время обработчиков и запросов к Bot API"""
+import time
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ConversationHandler, TypeHandler
+from telegram.request import HTTPXRequest
+import metrics
+import probes
+
+
+class BotAPIRequest(HTTPXRequest):
+    """HTTPXRequest, который замеряет каждый запрос к Bot API"""
+
+    def __init__(self, bot, **kwargs):
+        super().__init__(**kwargs)
+        self.bot = bot
+
+    async def do_request(self, url, method, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        start = time.perf_counter()
+        try:
+            status, payload = await super().do_request(url, method, *args, **kwargs)
+        except Exception:
+            metrics.bot_api_errors.inc(self.bot, api_method)
+            raise
+        finally:
+            metrics.bot_api_seconds.observe(time.perf_counter() - start, self.bot, api_method)
+        if status >= 400:
+            metrics.bot_api_errors.inc(self.bot, api_method)
+        return status, payload
+
+
+def _update_type(update):
+    for name in Update.ALL_TYPES:
+        if getattr(update, name, None) is not None:
+            return name
+    return "other"
+
+
+def _wrap(handler, bot):
+    if isinstance(handler, ConversationHandler):
+        nested = [*handler.entry_points, *handler.fallbacks]
+        for state_handlers in handler.states.values():
+            nested.extend(state_handlers)
+        for child in nested:
+            _wrap(child, bot)
+        return
+    callback = handler.callback
+    name = getattr(callback, "__name__", type(handler).__name__)
+    # ApplicationHandlerStop — штатная остановка (throttle, ConversationHandler), не ошибка обработчика
+    handler.callback = metrics.timed(
+        metrics.handler_seconds, metrics.handler_errors, bot, name, expected=ApplicationHandlerStop
+    )(callback)
+
+
+def instrument(app, bot):
+    """Замер всех уже зарегистрированных обработчиков (и внутри ConversationHandler) и счётчик апдейтов"""
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            _wrap(handler, bot)
+
+    async def count_update(update, context):
+        metrics.updates.inc(bot, _update_type(update))
+        probes.seen_update(bot)
+
+    # Группа -100 выполняется раньше всех и не мешает остальным
+    app.add_handler(TypeHandler(Update, count_update), group=-100)
@@ -0,0 +1,123 @@
+"""Рассылки corporate бота: получатели из серверного курсора, лимиты Telegram, чекпоинты для возобновления"""
+import asyncio
+import itertools
+import logging
+from datetime import timedelta
+from telegram.error import Forbidden, RetryAfter, TelegramError
+from config import BROADCAST_RATE, BROADCAST_CHAT_RATE, BROADCAST_CHUNK
+from database import (
+    create_broadcast, get_broadcast, get_broadcasts, save_broadcast_progress,
+    finish_broadcast, mark_users_blocked, broadcast_recipients
+)
+from ratelimit import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 3  # попыток на получателя после RetryAfter
+
+limiter = RateLimiter(BROADCAST_RATE, BROADCAST_CHAT_RATE)
+_tasks = {}  # id рассылки -> asyncio.Task
+
+
+def _seconds(value):
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
+
+
+async def _send(bot, chat_id, text):
+    """"sent", "blocked" (бот заблокирован/аккаунт удалён) или "failed" """
+    for _ in range(MAX_ATTEMPTS):
+        await limiter.acquire(chat_id)
+        try:
+            await bot.send_message(chat_id, text)
+            return "sent"
+        except RetryAfter as e:
+            # Flood control касается всего бота: останавливаем всех отправителей
+            limiter.pause(_seconds(e.retry_after))
+        except Forbidden:
+            return "blocked"
+        except TelegramError as e:
+            # В том числе TimedOut: сообщение могло уйти, повтор дал бы дубль
+            logger.warning(f"⚠️ Рассылка: не доставлено {chat_id}: {e}")
+            return "failed"
+    return "failed"
+
+
+async def _checkpoint(broadcast_id, chat_ids, results):
+    blocked = [chat_id for chat_id, result in zip(chat_ids, results) if result == "blocked"]
+    if blocked:
+        await mark_users_blocked(blocked)
+    return await save_broadcast_progress(
+        broadcast_id, chat_ids[-1], results.count("sent"), results.count("failed"), len(blocked)
+    )
+
+
+async def _send_chunk(bot, broadcast_id, chat_ids, text):
+    tasks = [asyncio.ensure_future(_send(bot, chat_id, text)) for chat_id in chat_ids]
+    try:
+        results = await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        # Остановка посреди пачки: сохраняем отправленное начало, чтобы при возобновлении не слать его повторно
+        done = list(itertools.takewhile(lambda task: task.done() and not task.cancelled(), tasks))
+        if done:
+            await _checkpoint(broadcast_id, chat_ids[:len(done)], [task.result() for task in done])
+        raise
+    return await _checkpoint(broadcast_id, chat_ids, results)
+
+
+async def _run(bot, broadcast_id):
+    broadcast = await get_broadcast(broadcast_id)
+    async with broadcast_recipients(broadcast_id, broadcast["last_user_id"]) as recipients:
+        if recipients is None:
+            logger.info(f"📣 Рассылку #{broadcast_id} ведёт другой процесс")
+            return
+        logger.info(f"📣 Рассылка #{broadcast_id}: с user_id > {broadcast['last_user_id']}")
+        while rows := await recipients.fetchmany(BROADCAST_CHUNK):
+            status = await _send_chunk(bot, broadcast_id, [row[0] for row in rows], broadcast["text"])
+            if status != "running":
+                logger.info(f"📣 Рассылка #{broadcast_id} остановлена ({status})")
+                return
+    await finish_broadcast(broadcast_id, "done")
+    logger.info(f"✅ Рассылка #{broadcast_id} завершена")
+
+
+def _spawn(bot, broadcast_id):
+    if broadcast_id in _tasks:
+        return
+
+    def done(task):
+        _tasks.pop(broadcast_id, None)
+        if not task.cancelled() and task.exception():
+            # Статус остаётся running: рассылка продолжится со следующего запуска
+            logger.error(f"❌ Рассылка #{broadcast_id} прервана: {task.exception()}")
+
+    task = _tasks[broadcast_id] = asyncio.create_task(_run(bot, broadcast_id))
+    task.add_done_callback(done)
+
+
+async def start(bot, text, admin_id):
+    """Создать и запустить рассылку; (id, число получателей)"""
+    broadcast_id, total = await create_broadcast(text, admin_id)
+    _spawn(bot, broadcast_id)
+    return broadcast_id, total
+
+
+async def cancel(broadcast_id):
+    """Отмена видна всем процессам: исполнитель проверяет статус после каждой пачки"""
+    await finish_broadcast(broadcast_id, "cancelled")
+    task = _tasks.get(broadcast_id)
+    if task is not None:
+        task.cancel()
+
+
+async def resume(bot):
+    """Продолжить рассылки, прерванные остановкой или падением процесса"""
+    for broadcast in await get_broadcasts(100, status="running"):
+        _spawn(bot, broadcast["id"])
+
+
+async def stop():
+    """Остановить рассылки этого процесса; прогресс до последней пачки уже сохранён"""
+    tasks = list(_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
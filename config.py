@@ -7,6 +7,50 @@ load_dotenv()
 # База данных
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+# Пул соединений с БД
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", 2))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))  # ожидание свободного соединения, сек
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", 300))  # закрывать простаивающие сверх min_size
+
+# Write-behind буфер для аналитики (uid_requests, shortened_links, corporate_users)
+WRITE_BUFFER_BATCH = int(os.getenv("WRITE_BUFFER_BATCH", 500))  # строк в одной пачке
+WRITE_BUFFER_INTERVAL = float(os.getenv("WRITE_BUFFER_INTERVAL", 2))  # сброс не реже, сек
+WRITE_BUFFER_MAX_PENDING = int(os.getenv("WRITE_BUFFER_MAX_PENDING", 10000))  # предел очереди
+WRITE_BUFFER_PUT_TIMEOUT = float(os.getenv("WRITE_BUFFER_PUT_TIMEOUT", 5))  # ожидание при переполнении, сек
+COUNTER_CACHE_TTL = float(os.getenv("COUNTER_CACHE_TTL", 10))  # кэш счётчиков из user_counters, сек
+
+# Исходящие HTTP запросы
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 3))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 5))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", 20))
+HTTP_PER_HOST_LIMIT = int(os.getenv("HTTP_PER_HOST_LIMIT", 10))  # одновременных запросов к одному хосту
+HTTP_MAX_HOSTS = int(os.getenv("HTTP_MAX_HOSTS", 1000))  # хостов со статистикой в памяти (LRU)
+# Хосты с собственной меткой host в метриках; остальные (ссылки пользователей) — host="other"
+HTTP_METRIC_HOSTS = {host.strip().lower() for host in os.getenv(
+    "HTTP_METRIC_HOSTS", "clck.ru,www.darkheavens.ru,api.telegram.org"
+).split(",") if host.strip()}
+
+# Собственный сокращатель ссылок: если задан публичный адрес лаунчера, clck.ru не используется
+SHORTENER_BASE_URL = (os.getenv("SHORTENER_BASE_URL") or "").rstrip("/")  # например https://s.darkheavens.ru
+SHORT_CODE_BLOCK_SIZE = int(os.getenv("SHORT_CODE_BLOCK_SIZE", 100))  # id, выделяемых за одно обращение к БД
+REDIRECT_CACHE_SIZE = int(os.getenv("REDIRECT_CACHE_SIZE", 10000))
+
+# Кэш результатов сокращения по нормализованному URL
+SHORTEN_CACHE_SIZE = int(os.getenv("SHORTEN_CACHE_SIZE", 10000))
+SHORTEN_CACHE_TTL = float(os.getenv("SHORTEN_CACHE_TTL", 86400))
+
+# Кэш username -> ID для uid_info бота
+USERNAME_CACHE_SIZE = int(os.getenv("USERNAME_CACHE_SIZE", 50000))
+USERNAME_CACHE_TTL = float(os.getenv("USERNAME_CACHE_TTL", 86400))  # найденные
+USERNAME_NEGATIVE_TTL = float(os.getenv("USERNAME_NEGATIVE_TTL", 600))  # "не найден"
+
+# Inline-запросы
+INLINE_DEBOUNCE = float(os.getenv("INLINE_DEBOUNCE", 0.4))  # пауза после последнего нажатия, сек
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", 300))  # кэш Telegram для результатов
+INLINE_HINT_CACHE_TIME = int(os.getenv("INLINE_HINT_CACHE_TIME", 86400))  # кэш Telegram для подсказок
+
 # Токены ботов
 BOTS = {
     "corporate": os.getenv("CORPORATE_BOT_TOKEN"),
@@ -15,5 +59,44 @@ BOTS = {
     "uid_info": os.getenv("UID_INFO_BOT_TOKEN"),
 }
 
+# Режим получения апдейтов: webhook, если задан публичный адрес HTTP сервера лаунчера, иначе polling
+WEBHOOK_URL = (os.getenv("WEBHOOK_URL") or "").rstrip("/")  # например https://bots.darkheavens.ru
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # из него выводятся секретные пути; по умолчанию — из токенов
+TELEGRAM_API_URL = (os.getenv("TELEGRAM_API_URL") or "").rstrip("/")  # свой/тестовый Bot API вместо api.telegram.org
+
+# Супервизор: LAUNCHER_MODE=supervisor запускает ботов в отдельных процессах и перезапускает упавшие
+LAUNCHER_MODE = os.getenv("LAUNCHER_MODE", "single")
+BOT_WORKERS = os.getenv("BOT_WORKERS", "")  # например "uid_info=2,link_shortener=2"; >1 воркера — только для webhook (апдейты закрепляются за воркером по id чата)
+WORKER_MEMORY_LIMIT_MB = int(os.getenv("WORKER_MEMORY_LIMIT_MB", 0))  # потолок RSS воркера, 0 — без ограничения
+
+# Пробы /live и /ready: проверка БД в фоне, пороги очередей для "не готов"
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", 10))  # SELECT 1 не чаще, сек
+READY_MAX_POOL_WAITING = int(os.getenv("READY_MAX_POOL_WAITING", 20))  # запросов, ждущих соединения с БД
+READY_MAX_HTTP_WAITING = int(os.getenv("READY_MAX_HTTP_WAITING", 50))  # исходящих запросов в очереди хостов
+
+# Рассылки corporate бота: Telegram допускает ~30 сообщений/с на бота и ~1/с в один чат
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25))  # сообщений в секунду, с запасом до 30
+BROADCAST_CHAT_RATE = float(os.getenv("BROADCAST_CHAT_RATE", 1))
+BROADCAST_CHUNK = int(os.getenv("BROADCAST_CHUNK", 100))  # получателей между сохранениями прогресса
+
+# Картинки ботов: file_id кэшируется, источник перепроверяется не чаще раза в интервал
+MEDIA_CHECK_INTERVAL = float(os.getenv("MEDIA_CHECK_INTERVAL", 3600))  # сек
+
+# Состояния диалогов и user_data в БД: изменения копятся в памяти и пишутся одной транзакцией
+PERSISTENCE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", 5))  # сек
+
+# Архив support бота: решённые тикеты переносятся в support_archive пачками
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", 30))  # сек между переносами
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", 1000))  # тикетов за один запрос
+
+# Ограничение входящих апдейтов: bucket на пользователя и общий на бота (в каждом процессе), админ не ограничивается
+THROTTLE_USER_RATE = float(os.getenv("THROTTLE_USER_RATE", 1))  # сообщений и нажатий в секунду
+THROTTLE_USER_BURST = int(os.getenv("THROTTLE_USER_BURST", 5))
+THROTTLE_INLINE_RATE = float(os.getenv("THROTTLE_INLINE_RATE", 3))  # inline-запросов в секунду (идут при наборе текста)
+THROTTLE_INLINE_BURST = int(os.getenv("THROTTLE_INLINE_BURST", 10))
+THROTTLE_GLOBAL_RATE = float(os.getenv("THROTTLE_GLOBAL_RATE", 100))  # апдейтов в секунду на бота
+THROTTLE_INLINE_RESERVE = float(os.getenv("THROTTLE_INLINE_RESERVE", 0.5))  # доля общего запаса, недоступная inline
+THROTTLE_MAX_USERS = int(os.getenv("THROTTLE_MAX_USERS", 100000))  # bucket'ов в памяти, давно неактивные вытесняются
+
 # Admin ID
 ADMIN_ID = int(os.getenv("ADMIN_ID", 0))
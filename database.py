@@ -1,241 +1,706 @@
 """Общий модуль для работы с базой данных Neon"""
-import psycopg
-from config import DATABASE_URL
-
-
-def get_connection():
-    """Получить соединение с БД"""
-    return psycopg.connect(DATABASE_URL)
-
-
-def init_db():
-    """Инициализация таблиц для всех ботов"""
-    conn = get_connection()
-    cur = conn.cursor()
-    
-    # Таблица для corporate бота - статистика пользователей
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS corporate_users (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT UNIQUE NOT NULL,
-            username VARCHAR(255),
-            first_name VARCHAR(255),
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    # Таблица для link shortener бота
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS shortened_links (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT NOT NULL,
-            original_url TEXT NOT NULL,
-            short_code VARCHAR(50),
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-    """)
-    
-    # Таблица для support бота - тикеты
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS support_tickets (
-            id SERIAL PRIMARY KEY,
-            ticket_id VARCHAR(50) UNIQUE NOT NULL,
-            user_id BIGINT NOT NULL,
-            username VARCHAR(255),
-            first_name VARCHAR(255),
-            last_name VARCHAR(255),
-            message TEXT NOT NULL,
-            priority VARCHAR(50),
-            status VARCHAR(50) DEFAULT 'Новый',
-            note TEXT,
-            admin_id BIGINT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            resolution_date TIMESTAMP
-        )
-    """)
-    
-    # Таблица для support бота - архив
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS support_archive (
-            id SERIAL PRIMARY KEY,
-            ticket_id VARCHAR(50) UNIQUE NOT NULL,
-            user_id BIGINT NOT NULL,
-            username VARCHAR(255),
-            message TEXT,
-            priority VARCHAR(50),
-            status VARCHAR(50),
-            rating INTEGER,
-            created_at TIMESTAMP,
-            resolution_date TIMESTAMP
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
+from psycopg import errors, sql
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+from config import (
+    DATABASE_URL, DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_TIMEOUT, DB_POOL_MAX_IDLE,
+    WRITE_BUFFER_BATCH, WRITE_BUFFER_INTERVAL, WRITE_BUFFER_MAX_PENDING, WRITE_BUFFER_PUT_TIMEOUT,
+    COUNTER_CACHE_TTL
+)
+from cache import TTLCache
+from migrations import migrate, LATEST_VERSION
+from write_buffer import WriteBehindBuffer
+import metrics
+
+_pool = None
+_pool_lock = asyncio.Lock()
+_counter_cache = TTLCache(50000, COUNTER_CACHE_TTL)
+
+
+def _timed(func):
+    """Время и ошибки функции — в /metrics (db_call_seconds, db_call_errors)"""
+    return metrics.timed(metrics.db_seconds, metrics.db_errors, func.__name__)(func)
+
+
+async def get_pool():
+    """Общий пул соединений (создаётся и открывается при первом обращении)"""
+    global _pool
+    if _pool is None:
+        async with _pool_lock:
+            if _pool is None:
+                pool = AsyncConnectionPool(
+                    DATABASE_URL,
+                    min_size=DB_POOL_MIN_SIZE,
+                    max_size=DB_POOL_MAX_SIZE,
+                    timeout=DB_POOL_TIMEOUT,
+                    max_idle=DB_POOL_MAX_IDLE,
+                    check=AsyncConnectionPool.check_connection,
+                    name="neon",
+                    open=False,
+                )
+                await pool.open()
+                _pool = pool
+    return _pool
+
+
+async def open_pool():
+    """Открыть пул заранее и дождаться прогрева min_size соединений"""
+    pool = await get_pool()
+    await pool.wait(timeout=DB_POOL_TIMEOUT)
+
+
+async def close_pool(_app=None):
+    """Записать буферы и закрыть пул (подходит как post_shutdown для Application)"""
+    global _pool
+    await flush_buffers()
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await pool.close()
+
+
+@asynccontextmanager
+async def connection():
+    """Взять соединение из пула; commit при успешном выходе, rollback при ошибке"""
+    pool = await get_pool()
+    async with pool.connection() as conn:
+        yield conn
+
+
+def get_pool_stats():
+    """Насыщенность пула и время ожидания соединения"""
+    if _pool is None:
+        return {}
+    stats = _pool.get_stats()
+    in_use = stats.get("pool_size", 0) - stats.get("pool_available", 0)
+    queued = stats.get("requests_queued", 0)
+    stats["pool_in_use"] = in_use
+    stats["saturation"] = round(in_use / _pool.max_size, 3)
+    stats["avg_wait_ms"] = round(stats.get("requests_wait_ms", 0) / queued, 1) if queued else 0.0
+    return stats
+
+
+async def init_db():
+    """Проверка версии схемы; миграции запускаются, только если схема отстаёт"""
+    try:
+        async with connection() as conn:
+            cur = await conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+            version = (await cur.fetchone())[0]
+    except errors.UndefinedTable:
+        version = 0
+    if version < LATEST_VERSION:
+        version = await migrate(DATABASE_URL)
+    print(f"✅ База данных инициализирована (схема v{version})")
+
+
+# Пакетная запись аналитики (write-behind)
+async def _copy_rows(table, columns, rows):
+    """Записать пачку строк одним COPY"""
+    async with connection() as conn, conn.cursor() as cur:
+        async with cur.copy(f"COPY {table} ({', '.join(columns)}) FROM STDIN") as copy:
+            for row in rows:
+                await copy.write_row(row)
+
+
+@_timed
+async def _flush_corporate_users(rows):
+    # COPY не умеет ON CONFLICT, поэтому один INSERT ... SELECT FROM unnest
+    unique = {row[0]: row for row in rows}
+    user_ids, usernames, first_names = zip(*unique.values())
+    async with connection() as conn:
+        await conn.execute("""
+            INSERT INTO corporate_users (user_id, username, first_name)
+            SELECT * FROM unnest(%s::bigint[], %s::varchar[], %s::varchar[])
+            ON CONFLICT (user_id) DO UPDATE
+            SET username = EXCLUDED.username, first_name = EXCLUDED.first_name, blocked_at = NULL
+            WHERE (corporate_users.username, corporate_users.first_name, corporate_users.blocked_at)
+                IS DISTINCT FROM (EXCLUDED.username, EXCLUDED.first_name, NULL)
+        """, (list(user_ids), list(usernames), list(first_names)))
+    # Только после записи: строка, отброшенная буфером, не должна навсегда отключать повторную запись
+    for user_id, username, first_name in unique.values():
+        _corporate_users[user_id] = hash((username, first_name))
+
+
+@_timed
+async def _flush_shortened_links(rows):
+    await _copy_rows("shortened_links", ("user_id", "original_url", "short_code", "url_hash"), rows)
+
+
+@_timed
+async def _flush_uid_requests(rows):
+    await _copy_rows("uid_requests", ("user_id", "target_username", "target_id"), rows)
+
+
+def _buffer(name, flush_func):
+    return WriteBehindBuffer(
+        name, flush_func,
+        max_batch=WRITE_BUFFER_BATCH,
+        flush_interval=WRITE_BUFFER_INTERVAL,
+        max_pending=WRITE_BUFFER_MAX_PENDING,
+        put_timeout=WRITE_BUFFER_PUT_TIMEOUT,
+    )
+
+
+_buffers = {
+    "corporate_users": _buffer("corporate_users", _flush_corporate_users),
+    "shortened_links": _buffer("shortened_links", _flush_shortened_links),
+    "uid_requests": _buffer("uid_requests", _flush_uid_requests),
+}
+
+
+async def flush_buffers():
+    """Записать всё накопленное в буферах (вызывается при остановке)"""
+    for buffer in _buffers.values():
+        await buffer.close()
+
+
+def get_buffer_stats():
+    """Статистика write-behind буферов"""
+    return {name: {**b.stats, "pending": b.pending()} for name, b in _buffers.items()}
+
+
+@metrics.add_collector
+def _collect_metrics():
+    pool = get_pool_stats()
+    buffers = get_buffer_stats()
+    return [
+        ("db_pool_connections", "gauge", "Соединения пула БД",
+         [("", {"state": state}, pool.get(key, 0))
+          for state, key in (("size", "pool_size"), ("available", "pool_available"), ("in_use", "pool_in_use"))]),
+        ("db_pool_waiting", "gauge", "Запросы, ждущие соединения", [("", {}, pool.get("requests_waiting", 0))]),
+        ("write_buffer_pending", "gauge", "Строки в write-behind буферах",
+         [("", {"buffer": name}, stats["pending"]) for name, stats in buffers.items()]),
+        ("write_buffer_dropped", "counter", "Строки, отброшенные буферами",
+         [("_total", {"buffer": name}, stats["dropped"]) for name, stats in buffers.items()]),
+        ("write_buffer_errors", "counter", "Неудачные записи пачек",
+         [("_total", {"buffer": name}, stats["errors"]) for name, stats in buffers.items()]),
+    ]
+
+
+# Счётчики (поддерживаются триггерами при вставке, см. migrations.py)
+async def _get_user_counter(bot, user_id):
+    key = (bot, user_id)
+    value = _counter_cache.get(key)
+    if value is None:
+        async with connection() as conn:
+            cur = await conn.execute(
+                "SELECT value FROM user_counters WHERE bot = %s AND user_id = %s", (bot, user_id)
+            )
+            row = await cur.fetchone()
+        value = row[0] if row else 0
+        _counter_cache.set(key, value)
+    return value
+
+
+async def _get_global_counter(name):
+    value = _counter_cache.get(name)
+    if value is None:
+        async with connection() as conn:
+            cur = await conn.execute("SELECT value FROM global_counters WHERE name = %s", (name,))
+            row = await cur.fetchone()
+        value = row[0] if row else 0
+        _counter_cache.set(name, value)
+    return value
+
+
+# Функции для corporate бота
+# user_id -> hash((username, first_name)) записанных незаблокированных пользователей: повторный /start без изменений не пишет в БД
+_corporate_users = {}
+
+
+async def warm_corporate_users():
+    """Загрузить известных пользователей corporate бота; возвращает их число"""
+    async with connection() as conn:
+        cur = conn.cursor()
+        async for user_id, username, first_name in cur.stream(
+            "SELECT user_id, username, first_name FROM corporate_users WHERE blocked_at IS NULL"
+        ):
+            _corporate_users[user_id] = hash((username, first_name))
+    return len(_corporate_users)
+
+
+@_timed
+async def add_corporate_user(user_id, username, first_name):
+    # Новый пользователь, смена имени или повторный /start после блокировки бота
+    fingerprint = hash((username, first_name))
+    if _corporate_users.get(user_id) == fingerprint:
+        return
+    await _buffers["corporate_users"].put((user_id, username, first_name))
+
+
+# Рассылки corporate бота
+BROADCAST_LOCK_ID = 7_340_002  # pg_try_advisory_lock(BROADCAST_LOCK_ID, id): одну рассылку ведёт один процесс
+
+
+@_timed
+async def create_broadcast(text, created_by):
+    """Новая рассылка; total — число получателей на момент создания"""
+    async with connection() as conn:
+        cur = await conn.execute("""
+            INSERT INTO broadcasts (text, created_by, total)
+            SELECT %s, %s, COUNT(*) FROM corporate_users WHERE blocked_at IS NULL
+            RETURNING id, total
+        """, (text, created_by))
+        return await cur.fetchone()
+
+
+@_timed
+async def get_broadcast(broadcast_id):
+    async with connection() as conn:
+        cur = conn.cursor(row_factory=dict_row)
+        await cur.execute("SELECT * FROM broadcasts WHERE id = %s", (broadcast_id,))
+        return await cur.fetchone()
+
+
+@_timed
+async def get_broadcasts(limit, status=None):
+    async with connection() as conn:
+        cur = conn.cursor(row_factory=dict_row)
+        await cur.execute("""
+            SELECT * FROM broadcasts WHERE %(status)s::varchar IS NULL OR status = %(status)s
+            ORDER BY id DESC LIMIT %(limit)s
+        """, {"status": status, "limit": limit})
+        return await cur.fetchall()
+
+
+@_timed
+async def save_broadcast_progress(broadcast_id, last_user_id, sent, failed, blocked):
+    """Чекпоинт после пачки получателей: счётчики прибавляются к сохранённым; возвращает статус рассылки"""
+    async with connection() as conn:
+        cur = await conn.execute("""
+            UPDATE broadcasts SET last_user_id = %s, sent = sent + %s, failed = failed + %s, blocked = blocked + %s
+            WHERE id = %s
+            RETURNING status
+        """, (last_user_id, sent, failed, blocked, broadcast_id))
+        return (await cur.fetchone())[0]
+
+
+@_timed
+async def finish_broadcast(broadcast_id, status):
+    async with connection() as conn:
+        await conn.execute(
+            "UPDATE broadcasts SET status = %s, finished_at = CURRENT_TIMESTAMP WHERE id = %s AND status = 'running'",
+            (status, broadcast_id)
         )
-    """)
-    
-    # Таблица для uid_info бота - статистика запросов
-    cur.execute("""
-        CREATE TABLE IF NOT EXISTS uid_requests (
-            id SERIAL PRIMARY KEY,
-            user_id BIGINT NOT NULL,
-            target_username VARCHAR(255),
-            target_id BIGINT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+
+
+@_timed
+async def mark_users_blocked(user_ids):
+    for user_id in user_ids:
+        _corporate_users.pop(user_id, None)
+    async with connection() as conn:
+        await conn.execute(
+            "UPDATE corporate_users SET blocked_at = CURRENT_TIMESTAMP WHERE user_id = ANY(%s)", (list(user_ids),)
         )
-    """)
-    
-    conn.commit()
-    cur.close()
-    conn.close()
-    print("✅ База данных инициализирована")
 
 
-# Функции для corporate бота
-def add_corporate_user(user_id, username, first_name):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO corporate_users (user_id, username, first_name) VALUES (%s, %s, %s) ON CONFLICT (user_id) DO NOTHING",
-        (user_id, username, first_name)
-    )
-    conn.commit()
-    cur.close()
-    conn.close()
+@asynccontextmanager
+async def broadcast_recipients(broadcast_id, after_user_id):
+    """Серверный курсор по получателям после after_user_id; None, если рассылку уже ведёт другой процесс.
+    WITH HOLD: результат остаётся на сервере после commit, и долгая рассылка не держит открытую транзакцию."""
+    async with connection() as conn:
+        cur = await conn.execute("SELECT pg_try_advisory_lock(%s, %s)", (BROADCAST_LOCK_ID, broadcast_id))
+        if not (await cur.fetchone())[0]:
+            yield None
+            return
+        try:
+            async with conn.cursor(f"broadcast_{broadcast_id}", withhold=True) as recipients:
+                await recipients.execute("""
+                    SELECT user_id FROM corporate_users
+                    WHERE blocked_at IS NULL AND user_id > %s
+                    ORDER BY user_id
+                """, (after_user_id,))
+                await conn.commit()
+                yield recipients
+        finally:
+            await conn.rollback()
+            await conn.execute("SELECT pg_advisory_unlock(%s, %s)", (BROADCAST_LOCK_ID, broadcast_id))
+
+
+# Кэш file_id картинок (media.py)
+@_timed
+async def get_media(bot_id, url):
+    async with connection() as conn:
+        cur = conn.cursor(row_factory=dict_row)
+        await cur.execute("""
+            SELECT file_id, etag, last_modified, content_hash,
+                   EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - checked_at)::float AS age
+            FROM media_cache WHERE bot_id = %s AND url = %s
+        """, (bot_id, url))
+        return await cur.fetchone()
+
+
+@_timed
+async def save_media(bot_id, url, file_id, etag, last_modified, content_hash):
+    async with connection() as conn:
+        await conn.execute("""
+            INSERT INTO media_cache (bot_id, url, file_id, etag, last_modified, content_hash)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (bot_id, url) DO UPDATE SET
+                file_id = EXCLUDED.file_id, etag = EXCLUDED.etag, last_modified = EXCLUDED.last_modified,
+                content_hash = EXCLUDED.content_hash, checked_at = CURRENT_TIMESTAMP
+        """, (bot_id, url, file_id, etag, last_modified, content_hash))
+
+
+@_timed
+async def mark_media_checked(url, changed):
+    """Источник проверен (для всех ботов); при изменении file_id сбрасывается"""
+    async with connection() as conn:
+        await conn.execute("""
+            UPDATE media_cache SET checked_at = CURRENT_TIMESTAMP,
+                file_id = CASE WHEN %s THEN NULL ELSE file_id END
+            WHERE url = %s
+        """, (changed, url))
+
+
+# Персистентность ботов (см. persistence.py)
+@_timed
+async def load_persistence(bot, kind):
+    """[(key, data)] одного вида данных бота"""
+    async with connection() as conn:
+        cur = await conn.execute("SELECT key, data FROM bot_persistence WHERE bot = %s AND kind = %s", (bot, kind))
+        return await cur.fetchall()
+
+
+@_timed
+async def save_persistence(bot, rows, deleted):
+    """Одна транзакция на пачку: rows — [(kind, key, json)], deleted — [(kind, key)]"""
+    async with connection() as conn:
+        if rows:
+            kinds, keys, values = zip(*rows)
+            await conn.execute("""
+                INSERT INTO bot_persistence (bot, kind, key, data)
+                SELECT %s, * FROM unnest(%s::varchar[], %s::text[], %s::jsonb[])
+                ON CONFLICT (bot, kind, key) DO UPDATE SET data = EXCLUDED.data, updated_at = CURRENT_TIMESTAMP
+            """, (bot, list(kinds), list(keys), list(values)))
+        if deleted:
+            kinds, keys = zip(*deleted)
+            await conn.execute("""
+                DELETE FROM bot_persistence
+                WHERE bot = %s AND (kind, key) IN (SELECT * FROM unnest(%s::varchar[], %s::text[]))
+            """, (bot, list(kinds), list(keys)))
 
 
 # Функции для link shortener бота
-def add_shortened_link(user_id, original_url, short_code):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO shortened_links (user_id, original_url, short_code) VALUES (%s, %s, %s)",
-        (user_id, original_url, short_code)
-    )
-    conn.commit()
-    cur.close()
-    conn.close()
+def url_hash(url):
+    """64-битный хэш URL для индекса shortened_links.url_hash"""
+    return int.from_bytes(hashlib.blake2b(url.encode(), digest_size=8).digest(), "big", signed=True)
 
 
-def get_user_links_count(user_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM shortened_links WHERE user_id = %s", (user_id,))
-    count = cur.fetchone()[0]
-    cur.close()
-    conn.close()
-    return count
+@_timed
+async def add_shortened_link(user_id, original_url, short_code, dedup_url=None):
+    """original_url сохраняется как прислал пользователь; url_hash — от ключа дедупликации (нормализованного URL)"""
+    await _buffers["shortened_links"].put((user_id, original_url, short_code, url_hash(dedup_url or original_url)))
 
 
-# Функции для support бота
-def create_ticket(ticket_id, user_id, username, first_name, last_name, message, priority):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO support_tickets (ticket_id, user_id, username, first_name, last_name, message, priority)
-        VALUES (%s, %s, %s, %s, %s, %s, %s)
-    """, (ticket_id, user_id, username, first_name, last_name, message, priority))
-    conn.commit()
-    cur.close()
-    conn.close()
-
-
-def update_ticket_status(ticket_id, status, admin_id=None):
-    conn = get_connection()
-    cur = conn.cursor()
-    if admin_id:
-        cur.execute(
-            "UPDATE support_tickets SET status = %s, admin_id = %s WHERE ticket_id = %s",
-            (status, admin_id, ticket_id)
+@_timed
+async def find_shortened_link(dedup_url, limit=10):
+    """Последние короткие ссылки с url_hash этого ключа: [(short_code, is_local, original_url)].
+    Совпадение ключа проверяет вызывающий (original_url хранится ненормализованным)"""
+    async with connection() as conn:
+        cur = await conn.execute("""
+            SELECT short_code, is_local, original_url FROM shortened_links
+            WHERE url_hash = %s AND short_code IS NOT NULL
+            ORDER BY id DESC LIMIT %s
+        """, (url_hash(dedup_url), limit))
+        return await cur.fetchall()
+
+
+@_timed
+async def allocate_short_ids(count):
+    """Выделить блок id для коротких кодов одним запросом"""
+    async with connection() as conn:
+        cur = await conn.execute("SELECT nextval('short_code_seq') FROM generate_series(1, %s)", (count,))
+        return [row[0] for row in await cur.fetchall()]
+
+
+@_timed
+async def add_local_link(user_id, original_url, short_code, dedup_url=None):
+    """Запись ссылки собственного сокращателя (сразу, без буфера: по ней будут редиректы)"""
+    async with connection() as conn:
+        await conn.execute(
+            "INSERT INTO shortened_links (user_id, original_url, short_code, is_local, url_hash) VALUES (%s, %s, %s, TRUE, %s)",
+            (user_id, original_url, short_code, url_hash(dedup_url or original_url))
+        )
+
+
+@_timed
+async def get_local_link(short_code):
+    async with connection() as conn:
+        cur = await conn.execute(
+            "SELECT original_url FROM shortened_links WHERE short_code = %s AND is_local", (short_code,)
         )
-    else:
-        cur.execute(
-            "UPDATE support_tickets SET status = %s WHERE ticket_id = %s",
-            (status, ticket_id)
+        row = await cur.fetchone()
+        return row[0] if row else None
+
+
+@_timed
+async def get_user_links_count(user_id):
+    return await _get_user_counter("link_shortener", user_id)
+
+
+# Функции для support бота
+@_timed
+async def create_ticket(user_id, username, first_name, last_name, message, priority):
+    """Создать тикет одним запросом; номер выдаёт ticket_id_seq. Возвращает ticket_id"""
+    async with connection() as conn:
+        cur = await conn.execute("""
+            INSERT INTO support_tickets (user_id, username, first_name, last_name, message, priority)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            RETURNING ticket_id
+        """, (user_id, username, first_name, last_name, message, priority))
+        return (await cur.fetchone())[0]
+
+
+@_timed
+async def update_ticket_status(ticket_id, status, admin_id=None):
+    async with connection() as conn:
+        if admin_id:
+            await conn.execute(
+                "UPDATE support_tickets SET status = %s, admin_id = %s WHERE ticket_id = %s",
+                (status, admin_id, ticket_id)
+            )
+        else:
+            await conn.execute(
+                "UPDATE support_tickets SET status = %s WHERE ticket_id = %s",
+                (status, ticket_id)
+            )
+
+
+@_timed
+async def add_ticket_note(ticket_id, note):
+    async with connection() as conn:
+        await conn.execute("UPDATE support_tickets SET note = %s WHERE ticket_id = %s", (note, ticket_id))
+
+
+@_timed
+async def resolve_ticket(ticket_id):
+    """Отметить тикет решённым; в support_archive его перенесёт archive_resolved_tickets"""
+    async with connection() as conn:
+        await conn.execute(
+            "UPDATE support_tickets SET resolution_date = CURRENT_TIMESTAMP WHERE ticket_id = %s AND resolution_date IS NULL",
+            (ticket_id,)
         )
-    conn.commit()
-    cur.close()
-    conn.close()
-
-
-def add_ticket_note(ticket_id, note):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("UPDATE support_tickets SET note = %s WHERE ticket_id = %s", (note, ticket_id))
-    conn.commit()
-    cur.close()
-    conn.close()
-
-
-def resolve_ticket(ticket_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        INSERT INTO support_archive (ticket_id, user_id, username, message, priority, status, created_at, resolution_date)
-        SELECT ticket_id, user_id, username, message, priority, status, created_at, CURRENT_TIMESTAMP
-        FROM support_tickets WHERE ticket_id = %s
-        ON CONFLICT (ticket_id) DO UPDATE SET status = EXCLUDED.status, resolution_date = EXCLUDED.resolution_date
-    """, (ticket_id,))
-    cur.execute("DELETE FROM support_tickets WHERE ticket_id = %s", (ticket_id,))
-    conn.commit()
-    cur.close()
-    conn.close()
-
-
-def get_ticket(ticket_id):
-    conn = get_connection()
-    cur = conn.cursor(row_factory=psycopg.rows.dict_row)
-    cur.execute("SELECT * FROM support_tickets WHERE ticket_id = %s", (ticket_id,))
-    ticket = cur.fetchone()
-    cur.close()
-    conn.close()
-    return ticket
-
-
-def get_next_ticket_id():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM support_tickets")
-    count = cur.fetchone()[0]
-    cur.close()
-    conn.close()
-    return count + 1
-
-
-def get_all_tickets():
-    conn = get_connection()
-    cur = conn.cursor(row_factory=psycopg.rows.dict_row)
-    cur.execute("SELECT * FROM support_tickets ORDER BY created_at DESC")
-    tickets = cur.fetchall()
-    cur.close()
-    conn.close()
-    return tickets
-
-
-def get_stats():
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM support_archive")
-    total = cur.fetchone()[0]
-    cur.close()
-    conn.close()
-    return total
+
+
+_archive_months = set()  # месяцы, для которых раздел support_archive уже создан
+
+
+@_timed
+async def archive_resolved_tickets(batch):
+    """Перенести до batch решённых тикетов в архив одним запросом; возвращает число перенесённых.
+    SKIP LOCKED — несколько воркеров support не ждут друг друга и не переносят одно и то же"""
+    async with connection() as conn:
+        # Плюс текущий и следующий месяц: тикет, решённый на границе месяцев после этого запроса,
+        # всё равно найдёт свой раздел (а осевшие в DEFAULT строки функция перенесёт сама)
+        cur = await conn.execute("""
+            SELECT DISTINCT date_trunc('month', resolution_date) FROM support_tickets WHERE resolution_date IS NOT NULL
+            UNION SELECT date_trunc('month', LOCALTIMESTAMP)
+            UNION SELECT date_trunc('month', LOCALTIMESTAMP) + INTERVAL '1 month'
+        """)
+        for (month,) in await cur.fetchall():
+            if month not in _archive_months:
+                await conn.execute("SELECT ensure_support_archive_partition(%s)", (month,))
+                _archive_months.add(month)
+        cur = await conn.execute("""
+            WITH moved AS (
+                DELETE FROM support_tickets WHERE id IN (
+                    SELECT id FROM support_tickets WHERE resolution_date IS NOT NULL
+                    ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED
+                )
+                RETURNING ticket_id, user_id, username, message, priority, status, created_at, resolution_date
+            )
+            INSERT INTO support_archive (ticket_id, user_id, username, message, priority, status, created_at, resolution_date)
+            SELECT * FROM moved
+        """, (batch,))
+        return cur.rowcount
+
+
+@_timed
+async def get_archive_partitions():
+    """Разделы support_archive: (имя, границы, примерное число строк)"""
+    async with connection() as conn:
+        cur = await conn.execute("""
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'support_archive'::regclass
+            ORDER BY c.relname
+        """)
+        return await cur.fetchall()
+
+
+# Столбцы выгрузки архива (без вычисляемого search)
+ARCHIVE_COLUMNS = (
+    "id", "ticket_id", "user_id", "username", "message", "priority", "status", "rating", "created_at", "resolution_date"
+)
+
+
+async def copy_archive_partition(name, fmt):
+    """Потоковая выгрузка раздела через COPY TO: блоки CSV или строки JSON"""
+    table = sql.Identifier(name)
+    columns = sql.SQL(", ").join(map(sql.Identifier, ARCHIVE_COLUMNS))
+    async with connection() as conn, conn.cursor() as cur:
+        if fmt == "csv":
+            query = sql.SQL("COPY (SELECT {} FROM {} ORDER BY id) TO STDOUT WITH (FORMAT csv, HEADER)").format(columns, table)
+            async with cur.copy(query) as copy:
+                async for data in copy:
+                    yield bytes(data)
+        else:
+            query = sql.SQL("COPY (SELECT row_to_json(t) FROM (SELECT {} FROM {} ORDER BY id) t) TO STDOUT").format(
+                columns, table
+            )
+            async with cur.copy(query) as copy:
+                copy.set_types(["text"])
+                async for (line,) in copy.rows():
+                    yield line.encode() + b"\n"
+
+
+@_timed
+async def detach_archive_partition(name, drop=False):
+    async with connection() as conn:
+        await conn.execute(sql.SQL("ALTER TABLE support_archive DETACH PARTITION {}").format(sql.Identifier(name)))
+        if drop:
+            await conn.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(name)))
+
+
+@_timed
+async def get_ticket(ticket_id):
+    async with connection() as conn:
+        cur = conn.cursor(row_factory=dict_row)
+        await cur.execute("SELECT * FROM support_tickets WHERE ticket_id = %s", (ticket_id,))
+        return await cur.fetchone()
+
+
+@_timed
+async def get_all_tickets():
+    async with connection() as conn:
+        cur = conn.cursor(row_factory=dict_row)
+        await cur.execute("SELECT * FROM support_tickets ORDER BY created_at DESC")
+        return await cur.fetchall()
+
+
+@_timed
+async def get_tickets_page(limit, after=None, before=None, status=None, priority=None):
+    """Страница тикетов по убыванию (priority_rank, created_at, id).
+
+    after/before — ключ (priority_rank, created_at, id) последней/первой строки соседней страницы.
+    Возвращает (строки, есть_ли_ещё_в_этом_направлении).
+    """
+    conditions, params = ["resolution_date IS NULL"], []
+    if status:
+        conditions.append("status = %s")
+        params.append(status)
+    if priority:
+        conditions.append("priority = %s")
+        params.append(priority)
+    if after:
+        conditions.append("(priority_rank, created_at, id) < (%s, %s, %s)")
+        params.extend(after)
+    elif before:
+        conditions.append("(priority_rank, created_at, id) > (%s, %s, %s)")
+        params.extend(before)
+    where = f"WHERE {' AND '.join(conditions)}"
+    order = "ASC" if before else "DESC"
+    async with connection() as conn:
+        cur = conn.cursor(row_factory=dict_row)
+        await cur.execute(f"""
+            SELECT id, ticket_id, user_id, username, LEFT(message, 100) AS message,
+                   priority, priority_rank, status, created_at
+            FROM support_tickets {where}
+            ORDER BY priority_rank {order}, created_at {order}, id {order}
+            LIMIT %s
+        """, (*params, limit + 1))
+        rows = await cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if before:
+        rows.reverse()
+    return rows, has_more
+
+
+@_timed
+async def search_tickets(text, limit, offset=0):
+    """Поиск по открытым тикетам, заметкам и архиву (websearch-синтаксис: слова, "фраза", -исключение).
+    Ранжирование ts_rank_cd; фрагменты с подсветкой считаются только для строк страницы.
+    Возвращает (строки, есть_ли_ещё)"""
+    async with connection() as conn:
+        cur = conn.cursor(row_factory=dict_row)
+        await cur.execute("""
+            WITH q AS (SELECT websearch_to_tsquery('russian', %(text)s) AS query),
+            found AS (
+                SELECT ticket_id, user_id, username, message, priority, status, created_at, resolution_date,
+                       FALSE AS archived, ts_rank_cd(search, q.query) AS rank
+                FROM support_tickets, q WHERE search @@ q.query
+                UNION ALL
+                SELECT ticket_id, user_id, username, message, priority, status, created_at, resolution_date,
+                       TRUE, ts_rank_cd(search, q.query)
+                FROM support_archive, q WHERE search @@ q.query
+                ORDER BY rank DESC, created_at DESC
+                LIMIT %(limit)s OFFSET %(offset)s
+            )
+            SELECT ticket_id, user_id, username, priority, status, created_at, resolution_date, archived,
+                   ts_headline('russian', message, q.query, 'MaxWords=15, MinWords=5, StartSel=«, StopSel=»') AS snippet
+            FROM found, q
+            ORDER BY rank DESC, created_at DESC
+        """, {"text": text, "limit": limit + 1, "offset": offset})
+        rows = await cur.fetchall()
+    return rows[:limit], len(rows) > limit
+
+
+@_timed
+async def get_stats():
+    return await _get_global_counter("tickets_resolved")
+
+
+@_timed
+async def get_support_rollup(days):
+    """Дневные агрегаты поддержки за последние days дней (support_daily_stats)"""
+    async with connection() as conn:
+        cur = conn.cursor(row_factory=dict_row)
+        await cur.execute("""
+            SELECT day, priority, status, opened, resolved, resolution_seconds, rated, rating_sum
+            FROM support_daily_stats
+            WHERE day > CURRENT_DATE - %s
+            ORDER BY day DESC
+        """, (days,))
+        return await cur.fetchall()
+
+
+@_timed
+async def get_backlog():
+    """Открытые тикеты: количество и самый старый"""
+    async with connection() as conn:
+        cur = await conn.execute("SELECT COUNT(*), MIN(created_at) FROM support_tickets WHERE resolution_date IS NULL")
+        return await cur.fetchone()
 
 
 # Функции для uid_info бота
-def add_uid_request(user_id, target_username, target_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO uid_requests (user_id, target_username, target_id) VALUES (%s, %s, %s)",
-        (user_id, target_username, target_id)
-    )
-    conn.commit()
-    cur.close()
-    conn.close()
-
-
-def get_user_requests_count(user_id):
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM uid_requests WHERE user_id = %s", (user_id,))
-    count = cur.fetchone()[0]
-    cur.close()
-    conn.close()
-    return count
+@_timed
+async def add_uid_request(user_id, target_username, target_id):
+    await _buffers["uid_requests"].put((user_id, target_username, target_id))
+
+
+@_timed
+async def get_recent_resolutions(max_age, limit):
+    """Последний результат по каждому username не старше max_age сек: (username, target_id, age)"""
+    async with connection() as conn:
+        cur = await conn.execute("""
+            SELECT username, target_id, age FROM (
+                SELECT DISTINCT ON (lower(target_username))
+                    lower(target_username) AS username, target_id, created_at,
+                    EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - created_at)::float AS age
+                FROM uid_requests
+                WHERE created_at > CURRENT_TIMESTAMP - make_interval(secs => %s)
+                ORDER BY lower(target_username), created_at DESC
+            ) latest
+            ORDER BY created_at DESC
+            LIMIT %s
+        """, (max_age, limit))
+        return await cur.fetchall()
+
+
+@_timed
+async def get_user_requests_count(user_id):
+    return await _get_user_counter("uid_info", user_id)
@@ -0,0 +1,133 @@
+"""Общий асинхронный HTTP клиент с keep-alive пулом и лимитами по хостам"""
+import asyncio
+import time
+from collections import deque
+from urllib.parse import urlsplit
+import httpx
+import metrics
+from cache import LRUCache
+from config import (
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_MAX_CONNECTIONS,
+    HTTP_MAX_KEEPALIVE, HTTP_PER_HOST_LIMIT, HTTP_MAX_HOSTS, HTTP_METRIC_HOSTS
+)
+
+_client = None
+# Хосты приходят из ссылок пользователей, поэтому их число ограничено. Запрос держит свой _HostState
+# до конца, так что вытеснение занятого хоста лишь ненадолго ослабит его лимит
+_hosts = LRUCache(HTTP_MAX_HOSTS)
+
+
+def metric_host(host):
+    """Метка host: известные хосты как есть, остальные — "other", чтобы не плодить временные ряды"""
+    return host if host in HTTP_METRIC_HOSTS else "other"
+
+
+class _HostState:
+    """Семафор и статистика задержек одного хоста"""
+
+    def __init__(self):
+        self.semaphore = asyncio.Semaphore(HTTP_PER_HOST_LIMIT)
+        self.waiting = 0
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.recent_ms = deque(maxlen=256)
+
+    def snapshot(self):
+        recent = sorted(self.recent_ms)
+
+        def pct(q):
+            return round(recent[min(len(recent) - 1, int(len(recent) * q))], 1) if recent else 0.0
+
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "avg_ms": round(self.total_ms / self.requests, 1) if self.requests else 0.0,
+            "p50_ms": pct(0.5),
+            "p95_ms": pct(0.95),
+            "max_ms": round(self.max_ms, 1),
+        }
+
+
+def get_client():
+    """Один httpx.AsyncClient на процесс"""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            ),
+            follow_redirects=False,
+        )
+    return _client
+
+
+async def request(method, url, **kwargs):
+    """HTTP запрос через общий клиент с ограничением параллельности на хост"""
+    host = urlsplit(url).hostname or ""
+    state = _hosts.get(host)
+    if state is None:
+        state = _HostState()
+        _hosts.set(host, state)
+
+    state.waiting += 1
+    try:
+        await state.semaphore.acquire()
+    finally:
+        state.waiting -= 1
+
+    state.in_flight += 1
+    start = time.perf_counter()
+    try:
+        return await get_client().request(method, url, **kwargs)
+    except Exception:
+        state.errors += 1
+        metrics.http_errors.inc(metric_host(host))
+        raise
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        metrics.http_seconds.observe(elapsed / 1000, metric_host(host))
+        state.in_flight -= 1
+        state.requests += 1
+        state.total_ms += elapsed
+        state.max_ms = max(state.max_ms, elapsed)
+        state.recent_ms.append(elapsed)
+        state.semaphore.release()
+
+
+async def get(url, **kwargs):
+    return await request("GET", url, **kwargs)
+
+
+def get_http_stats():
+    """Задержки и очереди по хостам"""
+    return {host: state.snapshot() for host, state in _hosts.items()}
+
+
+@metrics.add_collector
+def _collect_metrics():
+    in_flight, waiting = {}, {}
+    for host, state in _hosts.items():
+        label = metric_host(host)
+        in_flight[label] = in_flight.get(label, 0) + state.in_flight
+        waiting[label] = waiting.get(label, 0) + state.waiting
+    return [
+        ("http_in_flight", "gauge", "Исходящие запросы в работе",
+         [("", {"host": host}, value) for host, value in in_flight.items()]),
+        ("http_waiting", "gauge", "Запросы, ждущие лимита хоста",
+         [("", {"host": host}, value) for host, value in waiting.items()]),
+    ]
+
+
+async def close_http_client(_app=None):
+    """Закрыть пул соединений (подходит как post_shutdown для Application)"""
+    global _client
+    if _client is not None:
+        client, _client = _client, None
+        await client.aclose()
@@ -0,0 +1,158 @@
+"""Минимальный асинхронный HTTP/1.1 сервер на asyncio: вебхуки ботов, health и редиректы"""
+import asyncio
+import json
+import logging
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs, quote
+
+logger = logging.getLogger(__name__)
+
+MAX_BODY = 1 << 20  # апдейт Telegram заметно меньше 1 МБ
+MAX_HEADERS = 100
+IDLE_TIMEOUT = 75  # keep-alive соединение без запросов, сек
+
+
+class Request:
+    def __init__(self, method, target, version, headers, body):
+        parts = urlsplit(target)
+        self.method = method
+        self.path = parts.path or "/"
+        self.query = parse_qs(parts.query)
+        self.version = version
+        self.headers = headers
+        self.body = body
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class Response:
+    def __init__(self, body=b"", status=200, content_type="text/plain; charset=utf-8", headers=None):
+        self.body = body.encode() if isinstance(body, str) else body
+        self.status = status
+        self.headers = {"Content-Type": content_type, **(headers or {})}
+
+    def encode(self, keep_alive):
+        reason = HTTPStatus(self.status).phrase
+        headers = {
+            **self.headers,
+            "Content-Length": str(len(self.body)),
+            "Connection": "keep-alive" if keep_alive else "close",
+        }
+        head = f"HTTP/1.1 {self.status} {reason}\r\n" + "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+        return head.encode("latin-1") + b"\r\n" + self.body
+
+
+def json_response(data, status=200):
+    return Response(json.dumps(data, ensure_ascii=False, default=str), status, "application/json")
+
+
+def iri_to_uri(iri):
+    """Location должен быть ASCII: домен — в punycode, кириллица и пробелы в остальном — процентами"""
+    parts = urlsplit(iri)
+    host = parts.hostname
+    if host and not host.isascii():
+        try:
+            userinfo, _, hostport = parts.netloc.rpartition("@")
+            netloc = (userinfo + "@" if userinfo else "") + host.encode("idna").decode("ascii")
+            if parts.port is not None:
+                netloc += f":{parts.port}"
+            iri = parts._replace(netloc=netloc).geturl()
+        except UnicodeError:
+            pass  # останется процентная кодировка
+    return quote(iri, safe=":/?#[]@!$&'()*+,;=%~")
+
+
+def redirect(location, status=302):
+    return Response(b"", status, headers={"Location": iri_to_uri(location)})
+
+
+class HTTPServer:
+    """Маршруты по точному пути + fallback для всего остального"""
+
+    def __init__(self):
+        self.routes = {}
+        self.fallback = None
+        self._server = None
+
+    def add_route(self, path, handler):
+        self.routes[path] = handler
+
+    def remove_route(self, path):
+        self.routes.pop(path, None)
+
+    async def start(self, host, port, reuse_port=False):
+        self._server = await asyncio.start_server(
+            self._handle_connection, host, port, reuse_port=reuse_port or None
+        )
+
+    async def serve_forever(self):
+        await self._server.serve_forever()
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _read_request(self, reader):
+        line = await asyncio.wait_for(reader.readline(), IDLE_TIMEOUT)
+        if not line:
+            return None
+        method, target, version = line.decode("latin-1").split()
+        headers = {}
+        for _ in range(MAX_HEADERS):
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        else:
+            raise ValueError("too many headers")
+        length = int(headers.get("content-length", 0))
+        if length > MAX_BODY:
+            raise ValueError("body too large")
+        body = await reader.readexactly(length) if length else b""
+        return Request(method, target, version, headers, body)
+
+    async def dispatch(self, request):
+        handler = self.routes.get(request.path) or self.fallback
+        if handler is None:
+            return Response("Not Found", 404)
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error(f"❌ Ошибка обработки {request.method} {request.path}: {e}")
+            return Response("Internal Server Error", 500)
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except ValueError:
+                    writer.write(Response("Bad Request", 400).encode(keep_alive=False))
+                    break
+                if request is None:
+                    break
+                response = await self.dispatch(request)
+                keep_alive = (
+                    request.version == "HTTP/1.1" and request.headers.get("connection", "").lower() != "close"
+                )
+                try:
+                    data = response.encode(keep_alive)
+                except UnicodeEncodeError as e:
+                    # Заголовки HTTP/1.1 — latin-1; не рвать соединение из-за одного ответа
+                    logger.error(f"❌ Ответ на {request.method} {request.path} не кодируется: {e}")
+                    data = Response("Internal Server Error", 500).encode(keep_alive)
+                writer.write(data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
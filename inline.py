@@ -0,0 +1,65 @@
+"""Общий слой inline-запросов: debounce по пользователю, отмена устаревших запросов, single-flight"""
+import asyncio
+from config import INLINE_DEBOUNCE, INLINE_CACHE_TIME, INLINE_HINT_CACHE_TIME
+
+SUPERSEDED = object()  # результат Debouncer.run, если запрос вытеснен более новым
+
+
+class SingleFlight:
+    """Одновременные вызовы с одним ключом выполняются одним запросом к upstream"""
+
+    def __init__(self):
+        self._calls = {}
+
+    def _forget(self, key, future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        if not future.cancelled():
+            future.exception()  # чтобы ошибка без ожидающих не логировалась как непрочитанная
+
+    async def do(self, key, func):
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func())
+            self._calls[key] = future
+            future.add_done_callback(lambda f: self._forget(key, f))
+        # shield: отмена одного ожидающего не отменяет общий запрос
+        return await asyncio.shield(future)
+
+
+class Debouncer:
+    """Выполняет только последний запрос пользователя: новый запрос отменяет ожидающий/выполняющийся"""
+
+    def __init__(self, delay=INLINE_DEBOUNCE):
+        self.delay = delay
+        self._pending = {}
+
+    async def _delayed(self, func):
+        await asyncio.sleep(self.delay)
+        return await func()
+
+    async def run(self, user_id, func):
+        """Результат func() или SUPERSEDED, если запрос вытеснен более новым"""
+        previous = self._pending.pop(user_id, None)
+        if previous is not None:
+            previous.cancel()
+        task = asyncio.ensure_future(self._delayed(func))
+        self._pending[user_id] = task
+        try:
+            await asyncio.wait({task})
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            if self._pending.get(user_id) is task:
+                del self._pending[user_id]
+        if task.cancelled():
+            return SUPERSEDED
+        return task.result()
+
+
+async def answer(inline_query, results, personal=False, hint=False, cache_time=None):
+    """Ответ на inline-запрос с настройками кэша Telegram"""
+    if cache_time is None:
+        cache_time = INLINE_HINT_CACHE_TIME if hint else INLINE_CACHE_TIME
+    await inline_query.answer(results, cache_time=cache_time, is_personal=personal)
@@ -2,16 +2,15 @@
 """
 Лаунчер для запуска всех ботов
 """
-import subprocess
-import sys
 import asyncio
 import logging
 import os
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from telegram import Update
-from telegram.ext import Application
-from telegram.error import TimedOut, NetworkError
-from database import init_db
+import signal
+import hashlib
+import hmac
+import importlib
+import time
+import startup
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -19,53 +18,143 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+if __name__ == '__main__':
+    startup.ensure_dependencies()  # до импорта сторонних пакетов: на чистом окружении их ещё нет
 
-class HealthHandler(BaseHTTPRequestHandler):
-    """HTTP сервер для health checks"""
-    def do_GET(self):
-        self.send_response(200)
-        self.send_header('Content-type', 'text/plain')
-        self.end_headers()
-        self.wfile.write(b'OK')
-    
-    def log_message(self, format, *args):
-        pass  # Отключаем логи HTTP
+from telegram import Update
+from telegram.ext import Application
+from telegram.error import TimedOut, NetworkError
+from database import init_db, open_pool, close_pool
+from http_client import close_http_client
+from http_server import HTTPServer, Request, Response, json_response, redirect
+from config import (
+    BOTS, WEBHOOK_URL, WEBHOOK_SECRET, TELEGRAM_API_URL,
+    LAUNCHER_MODE, BOT_WORKERS, WORKER_MEMORY_LIMIT_MB
+)
+import shortener
+import metrics
+import bot_metrics
+import probes
+from bot_metrics import BotAPIRequest
+from persistence import PostgresPersistence
 
+startup.mark("импорты")
 
-def install_dependencies():
-    """Автоматическая установка зависимостей"""
-    logger.info("📦 Установка зависимостей...")
-    try:
-        subprocess.check_call(
-            [sys.executable, "-m", "pip", "install", "--upgrade", "--force-reinstall", "-r", "requirements.txt"],
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
-        )
-        logger.info("✅ Все зависимости установлены")
-    except Exception as e:
-        logger.error(f"❌ Ошибка установки зависимостей: {e}")
-        sys.exit(1)
+
+# Ключ бота в config.BOTS -> (название, модуль)
+BOT_SPECS = {
+    "corporate": ("Corporate Bot", "Dark_Heavens_Corporate_bot"),
+    "link_shortener": ("Link Shortener Bot", "SR_Link_ROBOT"),
+    "support": ("Support Bot", "support_bot"),
+    "uid_info": ("UID Info Bot", "uid_info_robot"),
+}
+
+http_server = HTTPServer()
+
+
+async def health(request):
+    return Response("OK")
+
+
+async def live(request):
+    ok, report = probes.liveness()
+    return json_response(report, 200 if ok else 503)
+
+
+async def ready(request):
+    ok, report = probes.readiness()
+    return json_response(report, 200 if ok else 503)
 
 
-async def run_bot(name, token, register_func):
-    """Запускает бота с перезапуском при ошибках сети"""
+async def metrics_handler(request):
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+async def fallback(request):
+    """Редиректы собственного сокращателя; остальные пути — health, как раньше"""
+    code = request.path.strip('/')
+    if not (shortener.enabled() and shortener.CODE_RE.match(code) and code.lower() not in shortener.RESERVED_CODES):
+        return Response("OK")
+    url = await shortener.resolve_code(code)
+    if url is None:
+        return Response("Not Found", 404)
+    return redirect(url)
+
+
+def webhook_secrets(key, token):
+    """Секретный путь вебхука бота и значение X-Telegram-Bot-Api-Secret-Token"""
+    secret = WEBHOOK_SECRET or token
+    path = hashlib.sha256(f"{secret}:{key}:path".encode()).hexdigest()[:32]
+    header = hashlib.sha256(f"{secret}:{key}:header".encode()).hexdigest()
+    return f"/tg/{key}/{path}", header
+
+
+def webhook_handler(app, secret_token):
+    """Принимает апдейт и кладёт его в update_queue приложения"""
+    async def handle(request):
+        if request.method != "POST":
+            return Response("Method Not Allowed", 405)
+        if not hmac.compare_digest(request.headers.get("x-telegram-bot-api-secret-token", ""), secret_token):
+            return Response("Forbidden", 403)
+        await app.update_queue.put(Update.de_json(request.json(), app.bot))
+        return Response("OK")
+    return handle
+
+
+def build_application(key, token):
+    builder = (
+        Application.builder().token(token)
+        .request(BotAPIRequest(key, connection_pool_size=256))
+        .get_updates_request(BotAPIRequest(key, connection_pool_size=1))
+        .persistence(PostgresPersistence(key))
+    )
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot").base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+    return builder.build()
+
+
+async def run_bot(key, name, register_func, post_init=None, post_stop=None):
+    """Запускает бота (polling или webhook) с перезапуском при ошибках сети"""
     from telegram.error import Conflict
     
+    token = BOTS[key]
     retry_count = 0
     max_retries = 10
+    state = probes.bot_state(key)
+    state.update(state="starting", retries=0)
+    first_start = True
     
     while retry_count < max_retries:
+        app = None
+        webhook_path = None
+        state["retries"] = retry_count
         try:
             logger.info(f"🚀 Запуск {name} (попытка {retry_count + 1})...")
             
-            app = Application.builder().token(token).build()
+            app = build_application(key, token)
             register_func(app)
+            bot_metrics.instrument(app, key)
             
-            # Инициализируем и запускаем polling
+            # Инициализируем и запускаем обработку апдейтов
             await app.initialize()
-            await app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+            if post_init:
+                await post_init(app)
+            await app.start()
             
-            logger.info(f"✅ {name} запущен")
+            if WEBHOOK_URL:
+                webhook_path, secret_token = webhook_secrets(key, token)
+                http_server.add_route(webhook_path, webhook_handler(app, secret_token))
+                await app.bot.set_webhook(
+                    f"{WEBHOOK_URL}{webhook_path}", secret_token=secret_token, allowed_updates=Update.ALL_TYPES
+                )
+                logger.info(f"✅ {name} запущен (webhook)")
+            else:
+                await app.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+                logger.info(f"✅ {name} запущен")
+            if first_start:
+                first_start = False
+                logger.info(f"⏱ {name}: первый успешный запрос к Bot API через {startup.elapsed():.2f} с после старта")
+            state["state"] = "running"
             
             # Держим бота запущенным
             while True:
@@ -73,59 +162,258 @@ async def run_bot(name, token, register_func):
                 
         except Conflict as e:
             logger.error(f"❌ {name}: конфликт (другой экземпляр запущен). Ждём 10 сек...")
+            state["state"] = "retrying"
             retry_count += 1
             await asyncio.sleep(10)
         except (TimedOut, NetworkError) as e:
+            state["state"] = "retrying"
             retry_count += 1
             logger.warning(f"⚠️ {name}: ошибка сети ({e}), перезапуск через 5 сек...")
             await asyncio.sleep(5)
         except Exception as e:
+            state["state"] = "failed"
             logger.error(f"❌ Ошибка {name}: {e}")
             raise
+        finally:
+            if webhook_path:
+                http_server.remove_route(webhook_path)
+            if app is not None:
+                await stop_application(app, post_stop)
+    state["state"] = "failed"
 
 
-async def run_health_server():
-    """Запускает HTTP сервер для health checks"""
+async def stop_application(app, post_stop=None):
+    """Останавливает приложение бота, не маскируя исходную ошибку"""
+    try:
+        if post_stop and app.running:
+            await post_stop(app)
+        if app.updater and app.updater.running:
+            await app.updater.stop()
+        if app.running:
+            await app.stop()
+        await app.shutdown()
+    except Exception as e:
+        logger.warning(f"⚠️ Ошибка остановки бота: {e}")
+
+
+async def run_http_server():
+    """Запускает общий HTTP сервер: вебхуки, health checks, редиректы"""
     port = int(os.environ.get('PORT', 8080))
-    server = HTTPServer(('0.0.0.0', port), HealthHandler)
-    logger.info(f"🌐 Health server запущен на порту {port}")
-    await asyncio.get_event_loop().run_in_executor(None, server.serve_forever)
+    http_server.routes.setdefault("/", health)
+    http_server.routes.setdefault("/health", health)
+    http_server.routes.setdefault("/metrics", metrics_handler)
+    http_server.routes.setdefault("/live", live)
+    http_server.routes.setdefault("/ready", ready)
+    http_server.fallback = fallback
+    await http_server.start('0.0.0.0', port)
+    logger.info(f"🌐 HTTP сервер запущен на порту {port}")
+    await http_server.serve_forever()
+
+
+def load_bot(key):
+    """Название бота, register_handlers, post_init и post_stop (если есть) его модуля"""
+    name, module_name = BOT_SPECS[key]
+    module = importlib.import_module(module_name)
+    return name, module.register_handlers, getattr(module, "post_init", None), getattr(module, "post_stop", None)
+
+
+def load_bots():
+    """Модули только тех ботов, чей токен задан: импорт остальных не тратит время старта"""
+    bots = {}
+    for key, (name, _) in BOT_SPECS.items():
+        if BOTS.get(key):
+            bots[key] = load_bot(key)
+        else:
+            logger.info(f"⏭ {name}: токен не задан, пропускаем")
+    startup.mark("модули ботов")
+    return bots
+
+
+async def stop_tasks(tasks):
+    """Отменить задачи и дождаться их finally (post_stop ботов) — до закрытия пула.
+    gather завершается на первой отменённой задаче, не дожидаясь остальных."""
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def handle_sigterm():
+    """SIGTERM от оркестратора/супервизора: отменяем задачи, чтобы finally записал буферы"""
+    main_task = asyncio.current_task()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main_task.cancel)
+    except NotImplementedError:
+        pass  # Windows
+
+
+async def send_heartbeats(key, conn):
+    """Состояние бота для супервизора. Connection.send блокирует, если супервизор не успевает читать,
+    поэтому отправка идёт в потоке: медленный супервизор задерживает heartbeat, но не цикл событий бота"""
+    from supervisor import HEARTBEAT_INTERVAL, METRICS_EVERY
+    beat = 0
+    while True:
+        ready, report = probes.readiness()
+        live, _ = probes.liveness()
+        status = {
+            "state": probes.bot_state(key)["state"], "pid": os.getpid(), "ts": time.time(),
+            "live": live, "ready": ready, "readiness": report,
+        }
+        if beat % METRICS_EVERY == 0:
+            status["metrics"] = metrics.collect()
+        beat += 1
+        try:
+            await asyncio.to_thread(conn.send, status)
+        except (BrokenPipeError, OSError):
+            return
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+
+
+def receive_webhooks(conn):
+    """Вебхук-запросы, принятые супервизором, обрабатываются маршрутами воркера"""
+    loop = asyncio.get_running_loop()
+    pending = set()
+
+    def on_readable():
+        try:
+            while conn.poll():
+                path, headers, body = conn.recv()
+                task = loop.create_task(http_server.dispatch(Request("POST", path, "HTTP/1.1", headers, body)))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        except (EOFError, OSError):
+            loop.remove_reader(conn.fileno())
+
+    loop.add_reader(conn.fileno(), on_readable)
+
+
+async def run_worker(key, index, conn):
+    """Процесс-воркер супервизора: один бот и heartbeat"""
+    name, register_func, post_init, post_stop = load_bot(key)
+    startup.mark("модуль бота")
+    handle_sigterm()
+    await open_pool()
+    startup.mark("БД")
+    startup.log_phases()
+    receive_webhooks(conn)
+    tasks = [
+        asyncio.create_task(run_bot(key, f"{name} #{index}", register_func, post_init, post_stop)),
+        asyncio.create_task(send_heartbeats(key, conn)),
+        asyncio.create_task(probes.check_db_forever()),
+    ]
+    try:
+        # Бот исчерпал попытки или упал — выходим, супервизор перезапустит процесс
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception():
+                raise task.exception()
+        raise SystemExit(1)
+    finally:
+        await stop_tasks(tasks)
+        await close_http_client()
+        await close_pool()
+
+
+async def run_supervisor():
+    """Режим супервизора: боты в отдельных процессах, общий health и редиректы здесь"""
+    from supervisor import Supervisor, parse_worker_counts, update_route_id
+    
+    logger.info("📊 Инициализация базы данных...")
+    try:
+        await open_pool()
+        await init_db()
+        logger.info("✅ База данных готова")
+    except Exception as e:
+        logger.error(f"❌ Ошибка инициализации БД: {e}")
+        return
+    startup.mark("БД")
+    startup.log_phases()
+    
+    counts = parse_worker_counts(BOT_WORKERS, [key for key in BOT_SPECS if BOTS.get(key)])
+    if not WEBHOOK_URL:
+        for key, count in counts.items():
+            if count > 1:
+                logger.warning(f"⚠️ {key}: в режиме polling возможен только один воркер")
+                counts[key] = 1
+    supervisor = Supervisor(counts, WORKER_MEMORY_LIMIT_MB)
+    
+    async def workers_health(request):
+        return json_response(supervisor.snapshot(), 200 if supervisor.healthy() else 503)
+    http_server.add_route("/health", workers_health)
+    
+    async def workers_metrics(request):
+        families = metrics.merge({"supervisor": metrics.collect(), **supervisor.metrics()})
+        return Response(metrics.render(families), content_type="text/plain; version=0.0.4; charset=utf-8")
+    http_server.add_route("/metrics", workers_metrics)
+    
+    async def workers_ready(request):
+        ok, report = probes.readiness()
+        workers = supervisor.readiness()
+        ok = ok and supervisor.healthy() and all(worker["ready"] for worker in workers.values())
+        return json_response({"ready": ok, "supervisor": report, "workers": workers}, 200 if ok else 503)
+    http_server.add_route("/ready", workers_ready)
+    
+    def forward_webhook(key):
+        async def handler(request):
+            # Секрет проверяет воркер; 503 — Telegram повторит доставку, когда воркер поднимется
+            message = (request.path, request.headers, request.body)
+            forwarded = supervisor.forward(key, message, update_route_id(request.body))
+            return Response("OK") if forwarded else Response("Unavailable", 503)
+        return handler
+    if WEBHOOK_URL:
+        for key in counts:
+            path, _ = webhook_secrets(key, BOTS[key])
+            http_server.add_route(path, forward_webhook(key))
+    
+    handle_sigterm()
+    logger.info("🎉 Запуск супервизора...")
+    try:
+        await asyncio.gather(run_http_server(), supervisor.run(), probes.check_db_forever())
+    finally:
+        await supervisor.stop()
+        await close_pool()
 
 
 async def main_async():
     """Асинхронный запуск всех ботов"""
-    # Импортируем модули ботов
-    import Dark_Heavens_Corporate_bot as corporate
-    import SR_Link_ROBOT as link_shortener
-    import support_bot as support
-    import uid_info_robot as uid_info
-    from config import BOTS
+    bots = load_bots()
+    if not bots:
+        logger.error("❌ Не задан ни один токен бота")
+        return
     
     # Инициализируем базу данных
     logger.info("📊 Инициализация базы данных...")
     try:
-        init_db()
+        await open_pool()
+        await init_db()
         logger.info("✅ База данных готова")
     except Exception as e:
         logger.error(f"❌ Ошибка инициализации БД: {e}")
         return
+    startup.mark("БД")
+    startup.log_phases()
     
-    # Запускаем health server и ботов одновременно
-    tasks = [
-        run_health_server(),
-        run_bot("Corporate Bot", BOTS["corporate"], corporate.register_handlers),
-        run_bot("Link Shortener Bot", BOTS["link_shortener"], link_shortener.register_handlers),
-        run_bot("Support Bot", BOTS["support"], support.register_handlers),
-        run_bot("UID Info Bot", BOTS["uid_info"], uid_info.register_handlers),
+    # Запускаем HTTP сервер и ботов одновременно
+    tasks = [asyncio.create_task(run_http_server()), asyncio.create_task(probes.check_db_forever())] + [
+        asyncio.create_task(run_bot(key, name, *hooks))
+        for key, (name, *hooks) in bots.items()
     ]
     
+    handle_sigterm()
+
     logger.info("🎉 Запуск всех ботов...")
-    await asyncio.gather(*tasks)
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        await stop_tasks(tasks)
+        await close_http_client()
+        await close_pool()  # сбрасывает write-behind буферы перед закрытием пула
 
 
 def main():
-    install_dependencies()
-    asyncio.run(main_async())
+    if LAUNCHER_MODE == "supervisor":
+        asyncio.run(run_supervisor())
+    else:
+        asyncio.run(main_async())
 
 
 if __name__ == '__main__':
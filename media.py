@@ -0,0 +1,130 @@
+"""Картинки ботов: загружаются в Telegram один раз, дальше отправляется file_id.
+file_id хранится в памяти и в media_cache; источник перепроверяется в фоне, и при изменении картинка загружается заново."""
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from urllib.parse import urlsplit
+from telegram import InputFile
+from telegram.error import BadRequest
+from config import MEDIA_CHECK_INTERVAL
+from database import get_media, save_media, mark_media_checked
+from http_client import get
+from inline import SingleFlight
+import probes
+
+logger = logging.getLogger(__name__)
+
+_entries = {}  # (bot_id, url) -> {"file_id", "etag", "last_modified", "content_hash", "checked"}
+_downloads = SingleFlight()
+_checking = set()
+
+
+async def _entry(bot_id, url):
+    key = (bot_id, url)
+    entry = _entries.get(key)
+    if entry is None:
+        row = await get_media(bot_id, url)
+        entry = {"file_id": None, "etag": None, "last_modified": None, "content_hash": None, "checked": time.monotonic()}
+        if row:
+            entry.update(
+                file_id=row["file_id"], etag=row["etag"], last_modified=row["last_modified"],
+                content_hash=row["content_hash"], checked=time.monotonic() - row["age"],
+            )
+        _entries[key] = entry
+    return entry
+
+
+async def _download(url):
+    response = await get(url)
+    response.raise_for_status()
+    return (
+        response.content, response.headers.get("etag"), response.headers.get("last-modified"),
+        hashlib.sha256(response.content).hexdigest(),
+    )
+
+
+async def _upload(bot, chat_id, url, entry, kwargs):
+    """Скачать источник (одна загрузка на все одновременные отправки) и отправить байтами"""
+    try:
+        content, etag, last_modified, content_hash = await _downloads.do(url, lambda: _download(url))
+        photo = InputFile(content, filename=os.path.basename(urlsplit(url).path) or "photo.jpg")
+    except Exception as e:
+        # Наш сервер недоступен напрямую — пусть Telegram попробует сам, file_id всё равно сохраним
+        logger.warning(f"⚠️ Не удалось скачать {url}: {e}")
+        photo, etag, last_modified, content_hash = url, None, None, None
+    message = await bot.send_photo(chat_id, photo, **kwargs)
+    file_id = message.photo[-1].file_id
+    entry.update(
+        file_id=file_id, etag=etag, last_modified=last_modified, content_hash=content_hash, checked=time.monotonic()
+    )
+    try:
+        await save_media(bot.id, url, file_id, etag, last_modified, content_hash)
+    except Exception as e:
+        # Картинка уже отправлена; file_id остаётся в памяти процесса
+        logger.warning(f"⚠️ Не удалось сохранить file_id для {url}: {e}")
+    return message
+
+
+async def _check(url, entry):
+    """Условный GET по ETag/Last-Modified (или сравнение хэша); изменившийся источник сбрасывает file_id у всех ботов"""
+    headers = {}
+    if entry["etag"]:
+        headers["If-None-Match"] = entry["etag"]
+    if entry["last_modified"]:
+        headers["If-Modified-Since"] = entry["last_modified"]
+    try:
+        response = await get(url, headers=headers)
+        if response.status_code == 304:
+            changed = False
+        else:
+            response.raise_for_status()
+            changed = hashlib.sha256(response.content).hexdigest() != entry["content_hash"]
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось проверить {url}: {e}")
+        return
+    finally:
+        _checking.discard(url)
+    if changed:
+        logger.info(f"🔄 Картинка {url} изменилась, будет загружена заново")
+        for (_, entry_url), other in _entries.items():
+            if entry_url == url:
+                other["file_id"] = None
+    try:
+        await mark_media_checked(url, changed)
+    except Exception as e:
+        logger.warning(f"⚠️ Не удалось отметить проверку {url}: {e}")
+
+
+def _schedule_check(url, entry):
+    if url in _checking:
+        return
+    _checking.add(url)
+    for (_, entry_url), other in _entries.items():
+        if entry_url == url:
+            other["checked"] = time.monotonic()
+    asyncio.create_task(_check(url, entry))
+
+
+async def send_photo(bot, chat_id, url, **kwargs):
+    """bot.send_photo по URL картинки, но через сохранённый file_id.
+    Без БД картинка отправляется по URL, как до кэша: /start не должен зависеть от media_cache"""
+    try:
+        if (bot.id, url) not in _entries and probes.db_unavailable():
+            raise ConnectionError("БД недоступна")
+        entry = await _entry(bot.id, url)
+    except Exception as e:
+        logger.warning(f"⚠️ media_cache недоступен ({e}), {url} отправляется по URL")
+        return await bot.send_photo(chat_id, url, **kwargs)
+    if entry["file_id"] and time.monotonic() - entry["checked"] > MEDIA_CHECK_INTERVAL:
+        _schedule_check(url, entry)
+    if entry["file_id"]:
+        try:
+            return await bot.send_photo(chat_id, entry["file_id"], **kwargs)
+        except BadRequest as e:
+            if "file" not in e.message.lower():
+                raise
+            logger.warning(f"⚠️ file_id для {url} больше не действителен: {e}")
+            entry["file_id"] = None
+    return await _upload(bot, chat_id, url, entry, kwargs)
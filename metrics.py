@@ -0,0 +1,137 @@
+"""Метрики в текстовом формате Prometheus: счётчики, гистограммы и значения, снимаемые при запросе.
+Запись — пара операций над dict без блокировок (всё в одном event loop), поэтому сбор можно не выключать."""
+import functools
+import time
+from bisect import bisect_left
+
+# Секунды: от быстрых запросов к БД до long polling
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_families = {}  # имя -> метрика, в порядке регистрации
+_collectors = []  # функции, возвращающие [(имя, тип, описание, [(суффикс, метки, значение)])]
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _families[name] = self
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self._values.items():
+            yield "_total", dict(zip(self.labelnames, labels)), value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}  # метки -> [счётчики корзин..., +Inf, сумма]
+        _families[name] = self
+
+    def observe(self, value, *labels):
+        data = self._values.get(labels)
+        if data is None:
+            data = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        data[bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    def samples(self):
+        for labels, data in self._values.items():
+            base = dict(zip(self.labelnames, labels))
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), data):
+                cumulative += count
+                yield "_bucket", {**base, "le": _format_value(bound)}, cumulative
+            yield "_sum", base, data[-1]
+            yield "_count", base, cumulative
+
+
+def add_collector(func):
+    """Значения, которые дешевле снять при запросе /metrics (пул БД, буферы, очереди)"""
+    _collectors.append(func)
+    return func
+
+
+def collect():
+    """Все метрики процесса: [(имя, тип, описание, [(суффикс, метки, значение)])] — годится для pickle"""
+    families = [(f.name, f.type, f.help, list(f.samples())) for f in _families.values()]
+    for collector in _collectors:
+        families.extend(collector())
+    return families
+
+
+def render(families=None):
+    lines = []
+    for name, type_, help, samples in collect() if families is None else families:
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {type_}")
+        for suffix, labels, value in samples:
+            lines.append(f"{name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+def merge(per_process):
+    """Метрики нескольких процессов в одно семейство на имя, с меткой worker"""
+    merged = {}
+    for worker, families in per_process.items():
+        for name, type_, help, samples in families:
+            family = merged.setdefault(name, (name, type_, help, []))
+            family[3].extend((suffix, {**labels, "worker": worker}, value) for suffix, labels, value in samples)
+    return list(merged.values())
+
+
+def timed(histogram, errors, *labels, expected=()):
+    """Декоратор async-функции: время в histogram, исключения в errors (с метками labels).
+    Исключения из expected — штатный исход (управление потоком), ошибкой не считаются"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except expected:
+                raise
+            except Exception:
+                errors.inc(*labels)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, *labels)
+        return wrapper
+    return decorator
+
+
+# Метрики, общие для модулей
+updates = Counter("bot_updates", "Апдейты Telegram", ("bot", "type"))
+handler_seconds = Histogram("bot_handler_seconds", "Время обработчиков", ("bot", "handler"))
+handler_errors = Counter("bot_handler_errors", "Исключения обработчиков", ("bot", "handler"))
+bot_api_seconds = Histogram("bot_api_request_seconds", "Запросы к Bot API", ("bot", "method"))
+bot_api_errors = Counter("bot_api_errors", "Ошибки Bot API (сеть или статус >= 400)", ("bot", "method"))
+db_seconds = Histogram("db_call_seconds", "Время функций database.py", ("function",))
+db_errors = Counter("db_call_errors", "Исключения функций database.py", ("function",))
+http_seconds = Histogram("http_request_seconds", "Исходящие HTTP запросы", ("host",))
+http_errors = Counter("http_request_errors", "Ошибки исходящих HTTP запросов", ("host",))
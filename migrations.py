@@ -0,0 +1,506 @@
+"""Версионированные миграции схемы БД.
+
+Каждая миграция применяется один раз и записывается в schema_migrations.
+Миграции с concurrent=True выполняются вне транзакции (для CREATE INDEX CONCURRENTLY),
+чтобы не блокировать запись в таблицы, по которым строятся индексы.
+"""
+import logging
+import re
+from collections import namedtuple
+import psycopg
+
+logger = logging.getLogger(__name__)
+
+Migration = namedtuple("Migration", "version name statements concurrent", defaults=(False,))
+
+MIGRATIONS = [
+    Migration(1, "base tables", [
+        # Таблица для corporate бота - статистика пользователей
+        """
+        CREATE TABLE IF NOT EXISTS corporate_users (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT UNIQUE NOT NULL,
+            username VARCHAR(255),
+            first_name VARCHAR(255),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Таблица для link shortener бота
+        """
+        CREATE TABLE IF NOT EXISTS shortened_links (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            original_url TEXT NOT NULL,
+            short_code VARCHAR(50),
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Таблица для support бота - тикеты
+        """
+        CREATE TABLE IF NOT EXISTS support_tickets (
+            id SERIAL PRIMARY KEY,
+            ticket_id VARCHAR(50) UNIQUE NOT NULL,
+            user_id BIGINT NOT NULL,
+            username VARCHAR(255),
+            first_name VARCHAR(255),
+            last_name VARCHAR(255),
+            message TEXT NOT NULL,
+            priority VARCHAR(50),
+            status VARCHAR(50) DEFAULT 'Новый',
+            note TEXT,
+            admin_id BIGINT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            resolution_date TIMESTAMP
+        )
+        """,
+        # Таблица для support бота - архив
+        """
+        CREATE TABLE IF NOT EXISTS support_archive (
+            id SERIAL PRIMARY KEY,
+            ticket_id VARCHAR(50) UNIQUE NOT NULL,
+            user_id BIGINT NOT NULL,
+            username VARCHAR(255),
+            message TEXT,
+            priority VARCHAR(50),
+            status VARCHAR(50),
+            rating INTEGER,
+            created_at TIMESTAMP,
+            resolution_date TIMESTAMP
+        )
+        """,
+        # Таблица для uid_info бота - статистика запросов
+        """
+        CREATE TABLE IF NOT EXISTS uid_requests (
+            id SERIAL PRIMARY KEY,
+            user_id BIGINT NOT NULL,
+            target_username VARCHAR(255),
+            target_id BIGINT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    Migration(2, "local short codes", [
+        # Коды собственного сокращателя (is_local) уникальны и ищутся при редиректе
+        "ALTER TABLE shortened_links ADD COLUMN IF NOT EXISTS is_local BOOLEAN NOT NULL DEFAULT FALSE",
+        "CREATE UNIQUE INDEX IF NOT EXISTS shortened_links_local_code_idx ON shortened_links (short_code) WHERE is_local",
+        "CREATE SEQUENCE IF NOT EXISTS short_code_seq START WITH 3844",  # коды от 3 символов
+        # Повторное сокращение того же URL ищется по хэшу нормализованного адреса
+        "ALTER TABLE shortened_links ADD COLUMN IF NOT EXISTS url_hash BIGINT",
+    ]),
+    Migration(3, "indexes for hot queries", [
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS shortened_links_url_hash_idx ON shortened_links (url_hash)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS shortened_links_user_id_idx ON shortened_links (user_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS uid_requests_user_id_idx ON uid_requests (user_id)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS uid_requests_created_at_idx ON uid_requests (created_at)",
+        "CREATE INDEX CONCURRENTLY IF NOT EXISTS support_tickets_created_at_idx ON support_tickets (created_at)",
+    ], concurrent=True),
+    Migration(4, "incremental counters", [
+        """
+        CREATE TABLE IF NOT EXISTS user_counters (
+            bot VARCHAR(50) NOT NULL,
+            user_id BIGINT NOT NULL,
+            value BIGINT NOT NULL DEFAULT 0,
+            PRIMARY KEY (bot, user_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS global_counters (
+            name VARCHAR(100) PRIMARY KEY,
+            value BIGINT NOT NULL DEFAULT 0
+        )
+        """,
+        # Триггеры уровня оператора: одна пачка COPY обновляет счётчики одним UPSERT
+        """
+        CREATE OR REPLACE FUNCTION count_user_rows() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO user_counters (bot, user_id, value)
+            SELECT TG_ARGV[0], user_id, COUNT(*) FROM new_rows GROUP BY user_id ORDER BY user_id
+            ON CONFLICT (bot, user_id) DO UPDATE SET value = user_counters.value + EXCLUDED.value;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE OR REPLACE FUNCTION count_global_rows() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO global_counters (name, value)
+            SELECT TG_ARGV[0], COUNT(*) FROM new_rows HAVING COUNT(*) > 0
+            ON CONFLICT (name) DO UPDATE SET value = global_counters.value + EXCLUDED.value;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        # Блокируем запись на время бэкфилла, чтобы строки не посчитались дважды
+        "LOCK TABLE shortened_links, uid_requests, support_archive IN SHARE MODE",
+        "DROP TRIGGER IF EXISTS shortened_links_count ON shortened_links",
+        """
+        CREATE TRIGGER shortened_links_count AFTER INSERT ON shortened_links
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION count_user_rows('link_shortener')
+        """,
+        "DROP TRIGGER IF EXISTS uid_requests_count ON uid_requests",
+        """
+        CREATE TRIGGER uid_requests_count AFTER INSERT ON uid_requests
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION count_user_rows('uid_info')
+        """,
+        "DROP TRIGGER IF EXISTS support_archive_count ON support_archive",
+        """
+        CREATE TRIGGER support_archive_count AFTER INSERT ON support_archive
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION count_global_rows('tickets_resolved')
+        """,
+        """
+        INSERT INTO user_counters (bot, user_id, value)
+        SELECT 'link_shortener', user_id, COUNT(*) FROM shortened_links GROUP BY user_id
+        UNION ALL
+        SELECT 'uid_info', user_id, COUNT(*) FROM uid_requests GROUP BY user_id
+        ON CONFLICT (bot, user_id) DO UPDATE SET value = EXCLUDED.value
+        """,
+        """
+        INSERT INTO global_counters (name, value)
+        SELECT 'tickets_resolved', COUNT(*) FROM support_archive
+        ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value
+        """,
+    ]),
+    Migration(5, "ticket id sequence", [
+        # Номер тикета выдаёт sequence: без COUNT(*), без дублей и без повторов после архивации
+        "LOCK TABLE support_tickets IN SHARE ROW EXCLUSIVE MODE",
+        "CREATE SEQUENCE IF NOT EXISTS ticket_id_seq",
+        """
+        SELECT setval('ticket_id_seq', GREATEST(
+            (SELECT MAX(ticket_id::bigint) FROM support_tickets WHERE ticket_id ~ '^[0-9]{1,18}$'),
+            (SELECT MAX(ticket_id::bigint) FROM support_archive WHERE ticket_id ~ '^[0-9]{1,18}$'),
+            0
+        ) + 1, false)
+        """,
+        "ALTER TABLE support_tickets ALTER COLUMN ticket_id SET DEFAULT nextval('ticket_id_seq')::text",
+    ]),
+    Migration(6, "ticket priority rank", [
+        # Числовой ранг приоритета для сортировки и keyset-пагинации списка тикетов
+        """
+        ALTER TABLE support_tickets ADD COLUMN IF NOT EXISTS priority_rank SMALLINT
+        GENERATED ALWAYS AS (
+            CASE priority WHEN 'Высокий' THEN 3 WHEN 'Средний' THEN 2 WHEN 'Низкий' THEN 1 ELSE 0 END
+        ) STORED
+        """,
+    ]),
+    Migration(7, "ticket browser index", [
+        """
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS support_tickets_browse_idx
+        ON support_tickets (priority_rank DESC, created_at DESC, id DESC)
+        """,
+    ], concurrent=True),
+    Migration(8, "support daily rollups", [
+        # Дневные агрегаты для панели статистики: читаются вместо сканирования архива
+        """
+        CREATE TABLE IF NOT EXISTS support_daily_stats (
+            day DATE NOT NULL,
+            priority VARCHAR(50) NOT NULL,
+            status VARCHAR(50) NOT NULL,
+            opened INTEGER NOT NULL DEFAULT 0,
+            resolved INTEGER NOT NULL DEFAULT 0,
+            resolution_seconds BIGINT NOT NULL DEFAULT 0,
+            rated INTEGER NOT NULL DEFAULT 0,
+            rating_sum INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, priority, status)
+        )
+        """,
+        """
+        CREATE OR REPLACE FUNCTION rollup_opened_tickets() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO support_daily_stats (day, priority, status, opened)
+            SELECT created_at::date, COALESCE(priority, ''), COALESCE(status, ''), COUNT(*)
+            FROM new_rows GROUP BY 1, 2, 3 ORDER BY 1, 2, 3
+            ON CONFLICT (day, priority, status) DO UPDATE
+            SET opened = support_daily_stats.opened + EXCLUDED.opened;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        CREATE OR REPLACE FUNCTION rollup_resolved_tickets() RETURNS trigger AS $$
+        BEGIN
+            INSERT INTO support_daily_stats (day, priority, status, resolved, resolution_seconds, rated, rating_sum)
+            SELECT resolution_date::date, COALESCE(priority, ''), COALESCE(status, ''), COUNT(*),
+                   COALESCE(SUM(EXTRACT(EPOCH FROM resolution_date - created_at)), 0)::bigint,
+                   COUNT(rating), COALESCE(SUM(rating), 0)
+            FROM new_rows WHERE resolution_date IS NOT NULL GROUP BY 1, 2, 3 ORDER BY 1, 2, 3
+            ON CONFLICT (day, priority, status) DO UPDATE SET
+                resolved = support_daily_stats.resolved + EXCLUDED.resolved,
+                resolution_seconds = support_daily_stats.resolution_seconds + EXCLUDED.resolution_seconds,
+                rated = support_daily_stats.rated + EXCLUDED.rated,
+                rating_sum = support_daily_stats.rating_sum + EXCLUDED.rating_sum;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        "LOCK TABLE support_tickets, support_archive IN SHARE MODE",
+        "DROP TRIGGER IF EXISTS support_tickets_rollup ON support_tickets",
+        """
+        CREATE TRIGGER support_tickets_rollup AFTER INSERT ON support_tickets
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION rollup_opened_tickets()
+        """,
+        "DROP TRIGGER IF EXISTS support_archive_rollup ON support_archive",
+        """
+        CREATE TRIGGER support_archive_rollup AFTER INSERT ON support_archive
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION rollup_resolved_tickets()
+        """,
+        "TRUNCATE support_daily_stats",
+        """
+        INSERT INTO support_daily_stats (day, priority, status, opened)
+        SELECT created_at::date, COALESCE(priority, ''), 'Новый', COUNT(*) FROM (
+            SELECT created_at, priority FROM support_tickets
+            UNION ALL
+            SELECT created_at, priority FROM support_archive
+        ) t WHERE created_at IS NOT NULL GROUP BY 1, 2
+        """,
+        """
+        INSERT INTO support_daily_stats (day, priority, status, resolved, resolution_seconds, rated, rating_sum)
+        SELECT resolution_date::date, COALESCE(priority, ''), COALESCE(status, ''), COUNT(*),
+               COALESCE(SUM(EXTRACT(EPOCH FROM resolution_date - created_at)), 0)::bigint,
+               COUNT(rating), COALESCE(SUM(rating), 0)
+        FROM support_archive WHERE resolution_date IS NOT NULL GROUP BY 1, 2, 3
+        ON CONFLICT (day, priority, status) DO UPDATE SET
+            resolved = EXCLUDED.resolved,
+            resolution_seconds = EXCLUDED.resolution_seconds,
+            rated = EXCLUDED.rated,
+            rating_sum = EXCLUDED.rating_sum
+        """,
+    ]),
+    Migration(9, "broadcasts", [
+        # Пользователи, заблокировавшие бота, пропускаются рассылками до следующего /start
+        "ALTER TABLE corporate_users ADD COLUMN IF NOT EXISTS blocked_at TIMESTAMP",
+        # Прогресс рассылки: получатели идут по возрастанию user_id, last_user_id — последний обработанный
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id SERIAL PRIMARY KEY,
+            text TEXT NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'running',
+            total INTEGER NOT NULL DEFAULT 0,
+            last_user_id BIGINT NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            created_by BIGINT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """,
+    ]),
+    Migration(10, "media cache", [
+        # file_id привязан к боту, поэтому ключ — (bot_id, url); валидаторы источника — для обновления
+        """
+        CREATE TABLE IF NOT EXISTS media_cache (
+            bot_id BIGINT NOT NULL,
+            url TEXT NOT NULL,
+            file_id TEXT,
+            etag TEXT,
+            last_modified TEXT,
+            content_hash TEXT,
+            checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (bot_id, url)
+        )
+        """,
+    ]),
+    Migration(11, "bot persistence", [
+        # Состояния диалогов, user_data, chat_data и bot_data ботов; kind: user, chat, bot, conversation:<имя>
+        """
+        CREATE TABLE IF NOT EXISTS bot_persistence (
+            bot VARCHAR(50) NOT NULL,
+            kind VARCHAR(100) NOT NULL,
+            key TEXT NOT NULL,
+            data JSONB NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (bot, kind, key)
+        )
+        """,
+    ]),
+    Migration(12, "partitioned support archive", [
+        # Архив по месяцам resolution_date: старые месяцы выгружаются и отсоединяются (archive.py),
+        # а чтение и VACUUM свежих разделов не тянут за собой всю историю
+        "LOCK TABLE support_archive IN ACCESS EXCLUSIVE MODE",
+        "ALTER TABLE support_archive RENAME TO support_archive_old",
+        "ALTER SEQUENCE support_archive_id_seq OWNED BY NONE",
+        # Уникальный ключ секционированной таблицы обязан включать ключ секционирования,
+        # поэтому ticket_id больше не UNIQUE: тикет попадает в архив один раз через DELETE ... RETURNING
+        """
+        CREATE TABLE support_archive (
+            id BIGINT NOT NULL DEFAULT nextval('support_archive_id_seq'),
+            ticket_id VARCHAR(50) NOT NULL,
+            user_id BIGINT NOT NULL,
+            username VARCHAR(255),
+            message TEXT,
+            priority VARCHAR(50),
+            status VARCHAR(50),
+            rating INTEGER,
+            created_at TIMESTAMP,
+            resolution_date TIMESTAMP NOT NULL,
+            PRIMARY KEY (id, resolution_date)
+        ) PARTITION BY RANGE (resolution_date)
+        """,
+        "ALTER SEQUENCE support_archive_id_seq OWNED BY support_archive.id",
+        "CREATE INDEX IF NOT EXISTS support_archive_ticket_id_idx ON support_archive (ticket_id)",
+        # Строки без подходящего раздела (его не успели создать) попадают сюда, а не в ошибку
+        "CREATE TABLE IF NOT EXISTS support_archive_default PARTITION OF support_archive DEFAULT",
+        """
+        CREATE OR REPLACE FUNCTION ensure_support_archive_partition(month TIMESTAMP) RETURNS VOID AS $$
+        DECLARE
+            start DATE := date_trunc('month', month);
+        BEGIN
+            EXECUTE format(
+                'CREATE TABLE IF NOT EXISTS %I PARTITION OF support_archive FOR VALUES FROM (%L) TO (%L)',
+                'support_archive_' || to_char(start, 'YYYY_MM'), start, start + INTERVAL '1 month'
+            );
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        """
+        SELECT ensure_support_archive_partition(month::timestamp) FROM (
+            SELECT DISTINCT date_trunc('month', COALESCE(resolution_date, created_at, CURRENT_TIMESTAMP)) AS month
+            FROM support_archive_old
+            UNION SELECT date_trunc('month', CURRENT_TIMESTAMP)
+        ) months
+        """,
+        """
+        INSERT INTO support_archive (id, ticket_id, user_id, username, message, priority, status, rating, created_at, resolution_date)
+        SELECT id, ticket_id, user_id, username, message, priority, status, rating, created_at,
+               COALESCE(resolution_date, created_at, CURRENT_TIMESTAMP)
+        FROM support_archive_old
+        """,
+        "DROP TABLE support_archive_old",
+        # Триггеры на родительской таблице срабатывают для всех разделов; после переноса — чтобы не считать дважды
+        """
+        CREATE TRIGGER support_archive_count AFTER INSERT ON support_archive
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION count_global_rows('tickets_resolved')
+        """,
+        """
+        CREATE TRIGGER support_archive_rollup AFTER INSERT ON support_archive
+        REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION rollup_resolved_tickets()
+        """,
+        # Решённые тикеты ждут пакетного переноса в архив
+        """
+        CREATE INDEX IF NOT EXISTS support_tickets_resolved_idx
+        ON support_tickets (id) WHERE resolution_date IS NOT NULL
+        """,
+    ]),
+    Migration(13, "ticket search", [
+        # Полнотекстовый поиск для /search: вектор считает сама БД при записи, текст заметки весит меньше текста тикета.
+        # Добавление STORED-столбца переписывает таблицу, поэтому индексы строятся здесь же, а не CONCURRENTLY
+        """
+        ALTER TABLE support_tickets ADD COLUMN IF NOT EXISTS search TSVECTOR
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('russian', COALESCE(message, '')), 'A') ||
+            setweight(to_tsvector('russian', COALESCE(note, '')), 'B')
+        ) STORED
+        """,
+        """
+        ALTER TABLE support_archive ADD COLUMN IF NOT EXISTS search TSVECTOR
+        GENERATED ALWAYS AS (setweight(to_tsvector('russian', COALESCE(message, '')), 'A')) STORED
+        """,
+        "CREATE INDEX IF NOT EXISTS support_tickets_search_idx ON support_tickets USING GIN (search)",
+        # На секционированной таблице индекс создаётся во всех разделах, в том числе будущих
+        "CREATE INDEX IF NOT EXISTS support_archive_search_idx ON support_archive USING GIN (search)",
+    ]),
+    Migration(14, "support archive partitions take rows from default", [
+        # Раздел месяца, строки которого уже лежат в support_archive_default, нельзя создать через PARTITION OF:
+        # таблица создаётся отдельно, строки переносятся из DEFAULT и она присоединяется — всё в одной транзакции
+        """
+        CREATE OR REPLACE FUNCTION ensure_support_archive_partition(month TIMESTAMP) RETURNS VOID AS $$
+        DECLARE
+            start DATE := date_trunc('month', month);
+            name TEXT := 'support_archive_' || to_char(start, 'YYYY_MM');
+            columns TEXT := 'id, ticket_id, user_id, username, message, priority, status, rating, created_at, resolution_date';
+        BEGIN
+            IF to_regclass(name) IS NOT NULL THEN
+                RETURN;
+            END IF;
+            -- Один создатель раздела за раз; вставки в DEFAULT ждут, пока строки месяца не переедут
+            LOCK TABLE support_archive IN SHARE UPDATE EXCLUSIVE MODE;
+            IF to_regclass(name) IS NOT NULL THEN
+                RETURN;
+            END IF;
+            LOCK TABLE support_archive_default IN ACCESS EXCLUSIVE MODE;
+            EXECUTE format('CREATE TABLE %I (LIKE support_archive INCLUDING DEFAULTS INCLUDING GENERATED)', name);
+            EXECUTE format(
+                'WITH moved AS (DELETE FROM support_archive_default WHERE resolution_date >= %L AND resolution_date < %L RETURNING %s) '
+                'INSERT INTO %I (%s) SELECT %s FROM moved',
+                start, start + INTERVAL '1 month', columns, name, columns, columns
+            );
+            EXECUTE format(
+                'ALTER TABLE support_archive ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                name, start, start + INTERVAL '1 month'
+            );
+        END
+        $$ LANGUAGE plpgsql
+        """,
+        # Текущий и следующий месяц заранее, и разделы для всего, что уже осело в DEFAULT
+        """
+        SELECT ensure_support_archive_partition(month) FROM (
+            SELECT DISTINCT date_trunc('month', resolution_date) AS month FROM support_archive_default
+            UNION SELECT date_trunc('month', LOCALTIMESTAMP)
+            UNION SELECT date_trunc('month', LOCALTIMESTAMP) + INTERVAL '1 month'
+        ) months
+        """,
+    ]),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+LOCK_ID = 7_340_001  # pg_advisory_lock: миграции выполняет один процесс
+
+_INDEX_NAME_RE = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.I)
+
+
+async def _drop_invalid_index(conn, statement):
+    """Прерванный CREATE INDEX CONCURRENTLY оставляет невалидный индекс — удаляем его перед повтором"""
+    match = _INDEX_NAME_RE.match(statement.strip())
+    if not match:
+        return
+    cur = await conn.execute("""
+        SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE c.relname = %s AND NOT i.indisvalid
+    """, (match.group(1),))
+    if await cur.fetchone():
+        logger.warning(f"⚠️ Удаляем невалидный индекс {match.group(1)}")
+        await conn.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {match.group(1)}")
+
+
+async def _current_version(conn):
+    cur = await conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    return (await cur.fetchone())[0]
+
+
+async def migrate(conninfo):
+    """Применить недостающие миграции; возвращает итоговую версию схемы"""
+    async with await psycopg.AsyncConnection.connect(conninfo, autocommit=True) as conn:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        await conn.execute("SELECT pg_advisory_lock(%s)", (LOCK_ID,))
+        try:
+            current = await _current_version(conn)
+            for migration in MIGRATIONS:
+                if migration.version <= current:
+                    continue
+                logger.info(f"📊 Миграция {migration.version}: {migration.name}")
+                if migration.concurrent:
+                    for statement in migration.statements:
+                        await _drop_invalid_index(conn, statement)
+                        await conn.execute(statement)
+                    await conn.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                        (migration.version, migration.name)
+                    )
+                else:
+                    async with conn.transaction():
+                        for statement in migration.statements:
+                            await conn.execute(statement)
+                        await conn.execute(
+                            "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                            (migration.version, migration.name)
+                        )
+                current = migration.version
+            return current
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock(%s)", (LOCK_ID,))
@@ -0,0 +1,117 @@
+"""Персистентность ботов в Postgres: состояния ConversationHandler, user_data, chat_data, bot_data.
+Application отдаёт изменения раз в PERSISTENCE_INTERVAL; они копятся в памяти (последнее значение на ключ)
+и пишутся одной транзакцией, неизменившиеся данные не пишутся вовсе."""
+import asyncio
+import json
+import logging
+from telegram.ext import BasePersistence, PersistenceInput
+from config import PERSISTENCE_INTERVAL
+from database import load_persistence, save_persistence
+
+logger = logging.getLogger(__name__)
+
+
+class PostgresPersistence(BasePersistence):
+    def __init__(self, bot, update_interval=PERSISTENCE_INTERVAL):
+        # callback_data не используется: кнопки ботов несут короткие строки
+        super().__init__(store_data=PersistenceInput(callback_data=False), update_interval=update_interval)
+        self.bot_key = bot
+        self._stored = {}  # (kind, key) -> хэш записанного JSON
+        self._dirty = {}  # (kind, key) -> JSON или None (удалить)
+        self._flushing = None
+
+    async def _load(self, kind):
+        rows = await load_persistence(self.bot_key, kind)
+        for key, data in rows:
+            self._stored[(kind, key)] = hash(json.dumps(data, sort_keys=True))
+        return rows
+
+    def _mark(self, kind, key, data):
+        if data is not None and data != {}:
+            try:
+                value = json.dumps(data, sort_keys=True)
+            except (TypeError, ValueError) as e:
+                logger.error(f"❌ {self.bot_key}: {kind} {key} не сериализуется в JSON: {e}")
+                return
+            if self._stored.get((kind, key)) == hash(value):
+                self._dirty.pop((kind, key), None)
+                return
+        elif (kind, key) not in self._stored:
+            self._dirty.pop((kind, key), None)
+            return
+        else:
+            value = None
+        self._dirty[(kind, key)] = value
+        # Application вызывает update_* пачкой через gather: задача записи стартует после всей пачки
+        if self._flushing is None or self._flushing.done():
+            self._flushing = asyncio.create_task(self._flush())
+
+    async def _flush(self):
+        while self._dirty:
+            dirty, self._dirty = self._dirty, {}
+            rows = [(kind, key, value) for (kind, key), value in dirty.items() if value is not None]
+            deleted = [item for item, value in dirty.items() if value is None]
+            try:
+                await save_persistence(self.bot_key, rows, deleted)
+            except Exception as e:
+                # Вернуть в очередь, если за это время не появилось значение новее
+                self._dirty = {**dirty, **self._dirty}
+                logger.error(f"❌ {self.bot_key}: не удалось сохранить состояние ({len(dirty)} записей): {e}")
+                return
+            for kind, key, value in rows:
+                self._stored[(kind, key)] = hash(value)
+            for item in deleted:
+                self._stored.pop(item, None)
+
+    async def get_user_data(self):
+        return {int(key): data for key, data in await self._load("user")}
+
+    async def get_chat_data(self):
+        return {int(key): data for key, data in await self._load("chat")}
+
+    async def get_bot_data(self):
+        rows = await self._load("bot")
+        return rows[0][1] if rows else {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {tuple(json.loads(key)): data for key, data in await self._load(f"conversation:{name}")}
+
+    async def update_user_data(self, user_id, data):
+        self._mark("user", str(user_id), data)
+
+    async def update_chat_data(self, chat_id, data):
+        self._mark("chat", str(chat_id), data)
+
+    async def update_bot_data(self, data):
+        self._mark("bot", "", data)
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def update_conversation(self, name, key, new_state):
+        # None — диалог завершён
+        self._mark(f"conversation:{name}", json.dumps(list(key)), new_state)
+
+    async def drop_user_data(self, user_id):
+        self._mark("user", str(user_id), None)
+
+    async def drop_chat_data(self, chat_id):
+        self._mark("chat", str(chat_id), None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass  # единственный писатель — этот процесс, в памяти всегда актуальные данные
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        """Вызывается Application при остановке, после последней передачи изменений"""
+        if self._flushing is not None:
+            await asyncio.gather(self._flushing, return_exceptions=True)
+        await self._flush()
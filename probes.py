@@ -0,0 +1,85 @@
+"""Liveness и readiness: отвечают из кэша, который обновляют бот-лаунчер и фоновая проверка БД"""
+import asyncio
+import time
+from config import HEALTH_CHECK_INTERVAL, READY_MAX_POOL_WAITING, READY_MAX_HTTP_WAITING
+from database import connection, get_pool_stats
+from http_client import get_http_stats
+
+bots = {}  # ключ бота -> {"state": starting|running|retrying|failed, "retries": ..., "last_update": ...}
+_db = {"ok": None, "latency_ms": None, "error": None, "checked_at": 0.0}
+
+
+def bot_state(key):
+    """Состояние бота, которое обновляет run_bot"""
+    return bots.setdefault(key, {"state": "starting", "retries": 0, "last_update": None})
+
+
+def seen_update(key):
+    bot_state(key)["last_update"] = time.monotonic()
+
+
+async def check_db_forever():
+    """SELECT 1 раз в HEALTH_CHECK_INTERVAL: сами пробы к БД не обращаются"""
+    while True:
+        start = time.perf_counter()
+        try:
+            async with connection() as conn:
+                await asyncio.wait_for(conn.execute("SELECT 1"), HEALTH_CHECK_INTERVAL)
+            _db.update(ok=True, error=None, latency_ms=round((time.perf_counter() - start) * 1000, 1))
+        except Exception as e:
+            _db.update(ok=False, error=str(e) or type(e).__name__, latency_ms=None)
+        _db["checked_at"] = time.monotonic()
+        await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+
+
+def db_unavailable():
+    """Последняя фоновая проверка БД не прошла: вызывающий может сразу взять запасной путь, не ожидая пула"""
+    return _db["ok"] is False
+
+
+def liveness():
+    """Жив, пока ни один бот не исчерпал попытки перезапуска (тогда поможет только рестарт)"""
+    failed = [key for key, state in bots.items() if state["state"] == "failed"]
+    return not failed, {"failed_bots": failed}
+
+
+def readiness():
+    """(готов, отчёт): боты запущены, БД отвечает, очереди к БД и внешним хостам в пределах порогов"""
+    now = time.monotonic()
+    problems = []
+    report_bots = {}
+    for key, state in bots.items():
+        last_update = state["last_update"]
+        report_bots[key] = {
+            "state": state["state"],
+            "retries": state["retries"],
+            "last_update_age": round(now - last_update, 1) if last_update else None,
+        }
+        if state["state"] != "running":
+            problems.append(f"bot {key} {state['state']}")
+
+    db_fresh = now - _db["checked_at"] < 3 * HEALTH_CHECK_INTERVAL
+    if not (_db["ok"] and db_fresh):
+        problems.append("db unreachable")
+    pool = get_pool_stats()
+    pool_waiting = pool.get("requests_waiting", 0)
+    if pool_waiting > READY_MAX_POOL_WAITING:
+        problems.append("db pool saturated")
+    http_waiting = sum(host["waiting"] for host in get_http_stats().values())
+    if http_waiting > READY_MAX_HTTP_WAITING:
+        problems.append("http queue")
+
+    return not problems, {
+        "ready": not problems,
+        "problems": problems,
+        "bots": report_bots,
+        "db": {
+            "ok": bool(_db["ok"] and db_fresh),
+            "latency_ms": _db["latency_ms"],
+            "error": _db["error"],
+            "checked_ago": round(now - _db["checked_at"], 1) if _db["checked_at"] else None,
+            "saturation": pool.get("saturation", 0),
+            "waiting": pool_waiting,
+        },
+        "http_waiting": http_waiting,
+    }
@@ -0,0 +1,67 @@
+"""Token bucket для исходящих сообщений (общий лимит бота и лимит на чат) и для входящих апдейтов (throttle.py)"""
+import asyncio
+import time
+from cache import LRUCache
+
+
+class TokenBucket:
+    """rate токенов в секунду, запас capacity. Токен берётся сразу (в долг), поэтому блокировка не нужна:
+    каждый вызывающий получает своё время ожидания, и очередь выстраивается сама."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "paused_until")  # их бывают сотни тысяч (по одному на пользователя)
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def reserve(self):
+        """Взять токен; возвращает, сколько секунд подождать перед отправкой"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return wait + max(0.0, self.paused_until - now)
+
+    def try_acquire(self, keep=0):
+        """Взять токен без долга, если после этого в запасе останется не меньше keep; иначе False"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens - 1 < keep:
+            return False
+        self.tokens -= 1
+        return True
+
+    def pause(self, seconds):
+        """Flood control от Telegram: никто не отправляет, пока не истечёт retry_after"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+class RateLimiter:
+    """Общий bucket бота + bucket на чат (вытесняются по LRU)"""
+
+    def __init__(self, rate, per_chat_rate, max_chats=10000):
+        self.bucket = TokenBucket(rate)
+        self.per_chat_rate = per_chat_rate
+        self._chats = LRUCache(max_chats)
+
+    async def acquire(self, chat_id):
+        chat_bucket = self._chats.get(chat_id)
+        if chat_bucket is None:
+            chat_bucket = TokenBucket(self.per_chat_rate, 1)
+            self._chats.set(chat_id, chat_bucket)
+        while True:
+            wait = max(chat_bucket.reserve(), self.bucket.reserve())
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if self.bucket.paused_until <= time.monotonic():
+                return
+            # Flood control начался, пока ждали: взятый до паузы токен не даёт права слать —
+            # встаём в очередь заново, reserve() учтёт паузу и разнесёт отправки после неё
+
+    def pause(self, seconds):
+        self.bucket.pause(seconds)
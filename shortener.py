@@ -0,0 +1,147 @@
+"""Сокращатель ссылок: нормализация и memo результатов, собственные base62 коды и редиректы по ним"""
+import asyncio
+import re
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from cache import LRUCache, TTLCache
+from config import (
+    SHORTENER_BASE_URL, SHORT_CODE_BLOCK_SIZE, REDIRECT_CACHE_SIZE, SHORTEN_CACHE_SIZE, SHORTEN_CACHE_TTL
+)
+from database import allocate_short_ids, add_local_link, get_local_link, find_shortened_link
+import metrics
+
+ALPHABET = "0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ"
+CODE_RE = re.compile(r"^[0-9A-Za-z]{1,16}$")
+
+# Пути HTTP сервера лаунчера, которые не должны стать кодами
+RESERVED_CODES = {"health", "healthz", "metrics", "live", "ready"}
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+TRACKING_PARAMS = {"fbclid", "gclid", "yclid", "ysclid", "dclid", "msclkid", "mc_cid", "mc_eid", "_openstat", "igshid"}
+
+redirect_cache = LRUCache(REDIRECT_CACHE_SIZE)
+# Первый уровень memo: нормализованный URL -> короткая ссылка; второй — shortened_links.url_hash
+shorten_cache = TTLCache(SHORTEN_CACHE_SIZE, SHORTEN_CACHE_TTL)
+db_cache_stats = {"hits": 0, "misses": 0}
+
+
+def enabled():
+    return bool(SHORTENER_BASE_URL)
+
+
+def encode_base62(number):
+    if number == 0:
+        return ALPHABET[0]
+    digits = []
+    while number:
+        number, rem = divmod(number, 62)
+        digits.append(ALPHABET[rem])
+    return "".join(reversed(digits))
+
+
+def normalize_url(url):
+    """Канонический вид URL: регистр схемы и хоста, порт по умолчанию, слэш в конце, трекинг-параметры.
+    Только ключ дедупликации: сокращается и сохраняется URL, присланный пользователем"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if ":" in host:
+        host = f"[{host}]"  # IPv6
+    if parts.port and parts.port != DEFAULT_PORTS.get(scheme):
+        host = f"{host}:{parts.port}"
+    if parts.username:
+        userinfo = parts.username + (f":{parts.password}" if parts.password else "")
+        host = f"{userinfo}@{host}"
+    path = parts.path.rstrip("/") or "/"
+    query = urlencode([
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in TRACKING_PARAMS and not k.lower().startswith("utm_")
+    ])
+    return urlunsplit((scheme, host, path, query, parts.fragment))
+
+
+def short_url_for(code, is_local):
+    return f"{SHORTENER_BASE_URL}/{code}" if is_local else f"https://clck.ru/{code}"
+
+
+async def lookup_shortened(normalized_url):
+    """Готовая короткая ссылка для нормализованного URL: сначала LRU, потом БД"""
+    short_url = shorten_cache.get(normalized_url)
+    if short_url is not None:
+        return short_url
+    # url_hash совпадает у всех вариантов записи одного URL, поэтому ключ сверяется заново
+    row = next((
+        (code, is_local) for code, is_local, original_url in await find_shortened_link(normalized_url)
+        if normalize_url(original_url) == normalized_url
+    ), None)
+    # Локальные коды без включённого движка не обслуживаются — считаем промахом
+    if row is None or (row[1] and not enabled()):
+        db_cache_stats["misses"] += 1
+        return None
+    db_cache_stats["hits"] += 1
+    short_url = short_url_for(*row)
+    shorten_cache.set(normalized_url, short_url)
+    return short_url
+
+
+def remember_shortened(normalized_url, short_url):
+    shorten_cache.set(normalized_url, short_url)
+
+
+def get_cache_stats():
+    """Попадания и промахи кэшей сокращателя"""
+    return {"memory": shorten_cache.stats(), "db": dict(db_cache_stats), "redirects": redirect_cache.stats()}
+
+
+@metrics.add_collector
+def _collect_metrics():
+    stats = get_cache_stats()
+    return [
+        ("shortener_cache_hits", "counter", "Попадания кэшей сокращателя",
+         [("_total", {"cache": name}, cache["hits"]) for name, cache in stats.items()]),
+        ("shortener_cache_misses", "counter", "Промахи кэшей сокращателя",
+         [("_total", {"cache": name}, cache["misses"]) for name, cache in stats.items()]),
+        ("shortener_cache_size", "gauge", "Записей в кэшах сокращателя в памяти",
+         [("", {"cache": name}, stats[name]["size"]) for name in ("memory", "redirects")]),
+    ]
+
+
+class CodeAllocator:
+    """Раздаёт коды из заранее выделенного блока id — без обращения к БД на каждый код"""
+
+    def __init__(self, block_size=SHORT_CODE_BLOCK_SIZE):
+        self.block_size = block_size
+        self._ids = []
+        self._lock = asyncio.Lock()
+
+    async def next_code(self):
+        async with self._lock:
+            while True:
+                if not self._ids:
+                    self._ids = await allocate_short_ids(self.block_size)
+                    self._ids.reverse()
+                code = encode_base62(self._ids.pop())
+                if code.lower() not in RESERVED_CODES:
+                    return code
+
+
+allocator = CodeAllocator()
+
+
+async def create_short_link(user_id, long_url, dedup_url=None):
+    """Создать короткую ссылку на long_url (как прислал пользователь) и вернуть её полный адрес"""
+    code = await allocator.next_code()
+    await add_local_link(user_id, long_url, code, dedup_url)
+    redirect_cache.set(code, long_url)
+    return f"{SHORTENER_BASE_URL}/{code}"
+
+
+async def resolve_code(code):
+    """URL для редиректа: из горячего LRU, иначе из БД"""
+    if not CODE_RE.match(code):
+        return None
+    url = redirect_cache.get(code)
+    if url is None:
+        url = await get_local_link(code)
+        if url is not None:
+            redirect_cache.set(code, url)
+    return url
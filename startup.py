@@ -0,0 +1,96 @@
+"""Холодный старт: проверка зависимостей без лишнего pip и замер фаз запуска.
+Только stdlib — модуль используется до того, как зависимости гарантированно установлены."""
+import hashlib
+import logging
+import re
+import subprocess
+import sys
+import time
+from importlib import metadata
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+REQUIREMENTS = Path(__file__).with_name("requirements.txt")
+STAMP = Path(__file__).with_name(".requirements.stamp")  # отпечаток после последней успешной установки
+
+STARTED = time.monotonic()
+phases = {}  # фаза -> секунды, в порядке выполнения
+_last = STARTED
+
+
+def mark(phase):
+    """Завершить фазу запуска: время с конца предыдущей фазы"""
+    global _last
+    now = time.monotonic()
+    phases[phase] = phases.get(phase, 0) + now - _last
+    _last = now
+
+
+def elapsed():
+    """Секунды с запуска процесса"""
+    return time.monotonic() - STARTED
+
+
+def log_phases():
+    summary = " · ".join(f"{phase} {seconds:.2f} с" for phase, seconds in phases.items())
+    logger.info(f"⏱ Фазы запуска: {summary} (всего {elapsed():.2f} с)")
+
+
+def _split_requirement(line):
+    """'psycopg[binary,pool]>=3' -> ('psycopg', ['binary', 'pool'])"""
+    match = re.match(r"\s*([A-Za-z0-9._-]+)\s*(?:\[([^\]]*)\])?", line)
+    extras = [extra.strip() for extra in (match.group(2) or "").split(",") if extra.strip()]
+    return match.group(1), extras
+
+
+def _extra_requirements(name, extras):
+    """Дистрибутивы, которые тянет extra (один уровень: psycopg[pool] -> psycopg-pool)"""
+    names = []
+    for requirement in metadata.requires(name) or []:
+        for extra in extras:
+            if re.search(rf"extra\s*==\s*['\"]{re.escape(extra)}['\"]", requirement):
+                names.append(_split_requirement(requirement)[0])
+    return names
+
+
+def fingerprint():
+    """Хэш requirements.txt и установленных версий; None, если чего-то не хватает"""
+    text = REQUIREMENTS.read_text()
+    parts = [text]
+    for line in text.splitlines():
+        line = line.split("#", 1)[0].strip()
+        if not line or line.startswith("-"):
+            continue
+        name, extras = _split_requirement(line)
+        try:
+            for dist in [name, *_extra_requirements(name, extras)]:
+                parts.append(f"{dist}=={metadata.version(dist)}")
+        except metadata.PackageNotFoundError:
+            return None
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+def ensure_dependencies():
+    """pip запускается, только если requirements.txt изменился или пакеты не установлены"""
+    current = fingerprint()
+    if current is not None and STAMP.exists() and STAMP.read_text().strip() == current:
+        logger.info("✅ Зависимости актуальны, pip пропущен")
+        mark("зависимости")
+        return
+    logger.info("📦 Установка зависимостей...")
+    try:
+        subprocess.check_call(
+            [sys.executable, "-m", "pip", "install", "--upgrade", "-r", str(REQUIREMENTS)],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        logger.info("✅ Все зависимости установлены")
+    except Exception as e:
+        logger.error(f"❌ Ошибка установки зависимостей: {e}")
+        sys.exit(1)
+    try:
+        STAMP.write_text(fingerprint() or "")
+    except OSError as e:
+        logger.warning(f"⚠️ Не удалось сохранить отпечаток зависимостей: {e}")
+    mark("зависимости")
@@ -0,0 +1,267 @@
+"""Супервизор: каждый бот (или несколько воркеров одного бота) в отдельном процессе"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+MAX_BACKOFF = 60  # сек между перезапусками
+STABLE_AFTER = 60  # воркер, проживший столько секунд, сбрасывает backoff
+HEARTBEAT_INTERVAL = 2  # сек между heartbeat воркера
+METRICS_EVERY = 5  # метрики воркера — с каждым пятым heartbeat
+HEARTBEAT_TIMEOUT = 30  # без heartbeat дольше — воркер считается зависшим
+FORWARD_QUEUE = 100  # вебхуков в очереди к одному воркеру; больше — 503, Telegram повторит
+
+
+def worker_main(key, index, conn):
+    """Точка входа процесса-воркера"""
+    import launcher
+    try:
+        asyncio.run(launcher.run_worker(key, index, conn))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass  # SIGTERM от супервизора: буферы уже сброшены в finally
+
+
+def parse_worker_counts(spec, keys):
+    """'uid_info=2,support=1' -> {'uid_info': 2, ...}; по умолчанию по одному воркеру на бота"""
+    counts = {key: 1 for key in keys}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        key, _, count = item.partition("=")
+        if key in counts:
+            counts[key] = max(1, int(count or 1))
+        else:
+            logger.warning(f"⚠️ BOT_WORKERS: неизвестный бот {key}")
+    return counts
+
+
+def update_route_id(body):
+    """Чат (или пользователь) апдейта из тела вебхука: по нему апдейт закрепляется за воркером.
+    None — у апдейта нет ни чата, ни пользователя (poll и т.п.)"""
+    try:
+        update = json.loads(body)
+    except ValueError:
+        return None
+    if not isinstance(update, dict):
+        return None
+    for name, value in update.items():
+        if name == "update_id" or not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        user = value.get("from") or value.get("user")
+        for source in (chat, user):
+            if isinstance(source, dict) and isinstance(source.get("id"), int):
+                return source["id"]
+    return None
+
+
+def rss_mb(pid):
+    """Резидентная память процесса (Linux), МБ"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+class Worker:
+    def __init__(self, key, index):
+        self.key = key
+        self.index = index
+        self.process = None
+        self.conn = None
+        self.started_at = 0.0
+        self.next_start = 0.0
+        self.backoff = 1
+        self.restarts = 0
+        self.status = {}
+        self.metrics = []
+        self.last_heartbeat = 0.0
+        self.outbox = None
+        self._io = None
+        self._tasks = []
+
+    @property
+    def name(self):
+        return f"{self.key}#{self.index}"
+
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def start(self, ctx):
+        # Двусторонний канал: от воркера heartbeat, к воркеру — вебхук-запросы
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=worker_main, args=(self.key, self.index, child_conn), name=f"bot-{self.name}")
+        self.process.start()
+        child_conn.close()
+        self.started_at = self.last_heartbeat = time.monotonic()
+        self.status = {}
+        self.metrics = []
+        # Connection.send/recv блокируют: зависший воркер перестаёт читать, буфер сокета заполняется.
+        # Поэтому канал обслуживают свои потоки, а цикл событий супервизора только кладёт в очередь
+        self.outbox = asyncio.Queue(FORWARD_QUEUE)
+        self._io = ThreadPoolExecutor(2, thread_name_prefix=f"pipe-{self.name}")
+        self._tasks = [asyncio.create_task(self._write(self.conn)), asyncio.create_task(self._read(self.conn))]
+        logger.info(f"🚀 Воркер {self.name} запущен (pid {self.process.pid})")
+
+    async def _write(self, conn):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await self.outbox.get()
+            try:
+                await loop.run_in_executor(self._io, conn.send, message)
+            except (OSError, ValueError):
+                return  # воркер завершился
+
+    async def _read(self, conn):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                status = await loop.run_in_executor(self._io, conn.recv)
+            except (EOFError, OSError, ValueError):
+                return
+            # Метрики приходят реже остальных heartbeat
+            if "metrics" in status:
+                self.metrics = status.pop("metrics")
+            self.status = status
+            self.last_heartbeat = time.monotonic()
+
+    def close_channel(self):
+        """Процесс уже завершился: потоки канала получат EOF/EPIPE и освободятся сами"""
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+        if self._io is not None:
+            self._io.shutdown(wait=False, cancel_futures=True)
+            self._io = None
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+        self.outbox = None
+
+    def send(self, message):
+        """Поставить вебхук в очередь воркера; False, если очередь полна (воркер не успевает) или канала нет"""
+        try:
+            self.outbox.put_nowait(message)
+            return True
+        except (AttributeError, asyncio.QueueFull):
+            return False
+
+    def stop(self):
+        if self.alive():
+            self.process.terminate()
+
+    def snapshot(self):
+        pid = self.process.pid if self.process else None
+        return {
+            "alive": self.alive(),
+            "pid": pid,
+            "restarts": self.restarts,
+            "uptime": round(time.monotonic() - self.started_at) if self.alive() else 0,
+            "rss_mb": round(rss_mb(pid) or 0, 1) if self.alive() else 0,
+            "heartbeat_age": round(time.monotonic() - self.last_heartbeat, 1),
+            **self.status,
+        }
+
+
+class Supervisor:
+    def __init__(self, counts, memory_limit_mb=0):
+        self.ctx = multiprocessing.get_context("spawn")
+        self.memory_limit_mb = memory_limit_mb
+        self.workers = [Worker(key, i + 1) for key, count in counts.items() for i in range(count)]
+        self._stopping = False
+        self._next = {}  # ключ бота -> номер следующего воркера для апдейтов без чата
+
+    def _schedule_restart(self, worker, reason):
+        now = time.monotonic()
+        if now - worker.started_at >= STABLE_AFTER:
+            worker.backoff = 1
+        worker.next_start = now + worker.backoff
+        logger.warning(f"⚠️ Воркер {worker.name}: {reason}, перезапуск через {worker.backoff} сек")
+        worker.backoff = min(worker.backoff * 2, MAX_BACKOFF)
+        worker.restarts += 1
+        worker.close_channel()
+
+    def _check(self, worker):
+        now = time.monotonic()
+        if worker.process is None:
+            if now >= worker.next_start:
+                worker.start(self.ctx)
+            return
+        if not worker.alive():
+            code = worker.process.exitcode
+            worker.process = None
+            self._schedule_restart(worker, f"завершился с кодом {code}")
+            return
+        if self.memory_limit_mb:
+            rss = rss_mb(worker.process.pid)
+            if rss and rss > self.memory_limit_mb:
+                logger.warning(f"⚠️ Воркер {worker.name}: {rss:.0f} МБ > {self.memory_limit_mb} МБ, останавливаем")
+                worker.stop()
+                return
+        if now - worker.last_heartbeat > HEARTBEAT_TIMEOUT:
+            logger.warning(f"⚠️ Воркер {worker.name}: нет heartbeat {now - worker.last_heartbeat:.0f} сек, останавливаем")
+            worker.process.kill()
+
+    async def run(self):
+        while not self._stopping:
+            for worker in self.workers:
+                self._check(worker)
+            await asyncio.sleep(1)
+
+    def forward(self, key, message, route_id=None):
+        """Передать вебхук-запрос воркеру бота; False, если некому.
+        Апдейты одного чата всегда идут одному воркеру: состояние диалогов, user_data и chat_data
+        живут в его памяти. Если этот воркер лежит — False (Telegram повторит), а не соседу,
+        у которого состояние чата устарело. Апдейты без чата — любому живому по кругу."""
+        if route_id is not None:
+            workers = [worker for worker in self.workers if worker.key == key]
+            if not workers:
+                return False
+            worker = workers[route_id % len(workers)]
+            return worker.alive() and worker.send(message)
+        workers = [worker for worker in self.workers if worker.key == key and worker.alive()]
+        for _ in workers:
+            index = self._next.get(key, 0) % len(workers)
+            self._next[key] = index + 1
+            if workers[index].send(message):
+                return True
+        return False
+
+    async def stop(self, timeout=15):
+        """SIGTERM всем воркерам (они сбрасывают буферы), затем kill оставшихся"""
+        self._stopping = True
+        for worker in self.workers:
+            worker.stop()
+        deadline = time.monotonic() + timeout
+        for worker in self.workers:
+            if worker.process is None:
+                continue
+            await asyncio.to_thread(worker.process.join, max(0, deadline - time.monotonic()))
+            if worker.process.is_alive():
+                logger.warning(f"⚠️ Воркер {worker.name} не остановился, kill")
+                os.kill(worker.process.pid, signal.SIGKILL)
+
+    def snapshot(self):
+        return {worker.name: worker.snapshot() for worker in self.workers}
+
+    def metrics(self):
+        """Последние метрики из heartbeat каждого живого воркера"""
+        return {worker.name: worker.metrics for worker in self.workers if worker.alive()}
+
+    def readiness(self):
+        """Readiness каждого воркера из последнего heartbeat"""
+        return {
+            worker.name: {**worker.status.get("readiness", {}), "ready": worker.alive() and worker.status.get("ready", False)}
+            for worker in self.workers
+        }
+
+    def healthy(self):
+        return all(worker.alive() for worker in self.workers)
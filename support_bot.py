@@ -9,8 +9,11 @@ from telegram.ext import (
 from config import BOTS, ADMIN_ID
 from database import (
     create_ticket, update_ticket_status, add_ticket_note, resolve_ticket,
-    get_ticket, get_next_ticket_id, get_all_tickets, get_stats
+    get_ticket, get_tickets_page, search_tickets, get_stats, get_support_rollup, get_backlog, close_pool
 )
+from persistence import PostgresPersistence
+import archive
+import throttle
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -21,6 +24,16 @@ PRIORITIES = {"1": "Низкий", "2": "Средний", "3": "Высокий"}
 
 CREATE_TICKET, CHOOSE_PRIORITY, ADD_NOTE = range(3)
 
+PAGE_SIZE = 5
+STATS_DAYS = 30
+# Фильтры браузера тикетов: ключ -> (статус, приоритет, заголовок)
+TICKET_FILTERS = {
+    "all": (None, None, "все"),
+    "new": (STATUSES["new"], None, "новые"),
+    "progress": (STATUSES["progress"], None, "в работе"),
+    "high": (None, PRIORITIES["3"], "высокий приоритет"),
+}
+
 
 async def start(update: Update, context):
     if update.effective_user.id == ADMIN_ID:
@@ -39,7 +52,7 @@ async def help_command(update: Update, context):
             [InlineKeyboardButton("📋 Тикеты", callback_data="list_tickets")],
             [InlineKeyboardButton("📊 Статистика", callback_data="show_stats")]
         ])
-        text = "⚙️ Панель Администратора\n\n/new - Создать тикет\n/list - Показать тикеты"
+        text = "⚙️ Панель Администратора\n\n/new - Создать тикет\n/list - Показать тикеты\n/search текст - Поиск по тикетам и архиву"
     else:
         keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("Создать тикет", callback_data="create_ticket")]])
         text = "🆘 Поддержка\n\nОпишите проблему или нажмите кнопку ниже."
@@ -67,9 +80,8 @@ async def set_priority(update: Update, context):
     priority = PRIORITIES[query.data.split('_')[1]]
     user = update.effective_user
     
-    ticket_id = str(get_next_ticket_id())
-    create_ticket(
-        ticket_id, user.id, user.username, user.first_name,
+    ticket_id = await create_ticket(
+        user.id, user.username, user.first_name,
         user.last_name or "", context.user_data['msg'], priority
     )
     
@@ -81,11 +93,7 @@ async def set_priority(update: Update, context):
         f"📝 {context.user_data['msg']}\n"
         f"Приоритет: {priority}"
     )
-    keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("⏳ В работу", callback_data=f"work_{ticket_id}")],
-        [InlineKeyboardButton("✅ Решить", callback_data=f"resolve_{ticket_id}")],
-        [InlineKeyboardButton("📝 Заметка", callback_data=f"note_{ticket_id}")]
-    ])
+    keyboard = InlineKeyboardMarkup(_ticket_buttons(ticket_id))
     await context.bot.send_message(ADMIN_ID, admin_text, reply_markup=keyboard)
     logger.info(f"Тикет #{ticket_id} создан")
     
@@ -93,39 +101,200 @@ async def set_priority(update: Update, context):
     return ConversationHandler.END
 
 
+def _encode_key(t):
+    return f"{t['priority_rank']}:{t['created_at']:%Y%m%d%H%M%S%f}:{t['id']}"
+
+
+def _decode_key(parts):
+    rank, ts, row_id = parts
+    return int(rank), datetime.strptime(ts, "%Y%m%d%H%M%S%f"), int(row_id)
+
+
+def _ticket_buttons(ticket_id):
+    return [
+        [InlineKeyboardButton("⏳ В работу", callback_data=f"work_{ticket_id}")],
+        [InlineKeyboardButton("✅ Решить", callback_data=f"resolve_{ticket_id}")],
+        [InlineKeyboardButton("📝 Заметка", callback_data=f"note_{ticket_id}")]
+    ]
+
+
+async def render_tickets_page(flt="all", direction="f", key=None):
+    """Текст и клавиатура одной страницы браузера тикетов"""
+    status, priority, title = TICKET_FILTERS[flt]
+    tickets, has_more = await get_tickets_page(
+        PAGE_SIZE, after=key if direction == "n" else None, before=key if direction == "p" else None,
+        status=status, priority=priority
+    )
+    has_next = has_more if direction != "p" else True
+    has_prev = direction == "n" or (direction == "p" and has_more)
+    if not tickets:
+        has_next = has_prev = False
+
+    lines = [f"📋 Тикеты: {title}\n"]
+    for t in tickets:
+        lines.append(
+            f"🎫 #{t['ticket_id']} · {t['priority']} · {t['status']}\n"
+            f"👤 {t['username']} (ID: {t['user_id']})\n"
+            f"📝 {t['message']}\n"
+        )
+    if not tickets:
+        lines.append("Нет активных тикетов!")
+
+    keyboard = [[InlineKeyboardButton(f"🎫 #{t['ticket_id']}", callback_data=f"tv:{flt}:{t['ticket_id']}")] for t in tickets]
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton("⬅️", callback_data=f"tp:{flt}:p:{_encode_key(tickets[0])}"))
+    if has_next:
+        nav.append(InlineKeyboardButton("➡️", callback_data=f"tp:{flt}:n:{_encode_key(tickets[-1])}"))
+    if nav:
+        keyboard.append(nav)
+    keyboard.append([
+        InlineKeyboardButton(("• " if f == flt else "") + label, callback_data=f"tp:{f}:f")
+        for f, label in (("all", "Все"), ("new", "Новые"), ("progress", "В работе"), ("high", "Высокий"))
+    ])
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+
 async def list_tickets(update: Update, context):
+    """Новое сообщение-браузер тикетов (дальше оно редактируется на месте)"""
     if update.effective_user.id != ADMIN_ID:
         return
     
-    tickets = get_all_tickets()
-    if not tickets:
-        await update.callback_query.answer("Нет активных тикетов!")
+    text, keyboard = await render_tickets_page()
+    await context.bot.send_message(ADMIN_ID, text, reply_markup=keyboard)
+    if update.callback_query:
+        await update.callback_query.answer()
+
+
+async def browse_tickets(update: Update, context):
+    """Листание и просмотр тикетов в том же сообщении"""
+    query = update.callback_query
+    if update.effective_user.id != ADMIN_ID:
+        await query.answer()
+        return
+    
+    parts = query.data.split(':')
+    await query.answer()
+    if parts[0] == "tp":
+        flt, direction = parts[1], parts[2]
+        key = _decode_key(parts[3:]) if direction != "f" else None
+        text, keyboard = await render_tickets_page(flt, direction, key)
+        await query.edit_message_text(text, reply_markup=keyboard)
         return
     
+    flt, ticket_id = parts[1], parts[2]
+    t = await get_ticket(ticket_id)
+    if not t:
+        text, keyboard = await render_tickets_page(flt)
+        await query.edit_message_text(text, reply_markup=keyboard)
+        return
+    text = (
+        f"🎫 #{t['ticket_id']}\n"
+        f"👤 {t['username']} (ID: {t['user_id']})\n"
+        f"📝 {t['message']}\n"
+        f"Приоритет: {t['priority']}\n"
+        f"Статус: {t['status']}"
+        + (f"\nЗаметка: {t['note']}" if t['note'] else "")
+    )
+    keyboard = _ticket_buttons(t['ticket_id']) + [[InlineKeyboardButton("⬅️ К списку", callback_data=f"tp:{flt}:f")]]
+    await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+
+
+async def render_search_page(text, offset=0):
+    """Текст и клавиатура страницы результатов поиска"""
+    tickets, has_more = await search_tickets(text, PAGE_SIZE, offset)
+    lines = [f"🔍 {text}\n"]
     for t in tickets:
-        text = (
-            f"🎫 #{t['ticket_id']}\n"
+        status = "в архиве" if t['archived'] else ("решён" if t['resolution_date'] else t['status'])
+        lines.append(
+            f"🎫 #{t['ticket_id']} · {t['priority']} · {status} · {t['created_at']:%d.%m.%Y}\n"
             f"👤 {t['username']} (ID: {t['user_id']})\n"
-            f"📝 {t['message']}\n"
-            f"Приоритет: {t['priority']}\n"
-            f"Статус: {t['status']}"
+            f"📝 {t['snippet']}\n"
         )
-        keyboard = InlineKeyboardMarkup([
-            [InlineKeyboardButton("⏳ В работу", callback_data=f"work_{t['ticket_id']}")],
-            [InlineKeyboardButton("✅ Решить", callback_data=f"resolve_{t['ticket_id']}")],
-            [InlineKeyboardButton("📝 Заметка", callback_data=f"note_{t['ticket_id']}")]
-        ])
-        await context.bot.send_message(ADMIN_ID, text, reply_markup=keyboard)
+    if not tickets:
+        lines.append("Ничего не найдено.")
+    keyboard = [
+        [InlineKeyboardButton(f"🎫 #{t['ticket_id']}", callback_data=f"tv:all:{t['ticket_id']}")]
+        for t in tickets if not t['archived'] and not t['resolution_date']
+    ]
+    nav = []
+    if offset:
+        nav.append(InlineKeyboardButton("⬅️", callback_data=f"sr:{max(offset - PAGE_SIZE, 0)}"))
+    if has_more:
+        nav.append(InlineKeyboardButton("➡️", callback_data=f"sr:{offset + PAGE_SIZE}"))
+    if nav:
+        keyboard.append(nav)
+    return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+
+async def search_command(update: Update, context):
+    """/search текст — поиск по тикетам, заметкам и архиву"""
+    if update.effective_user.id != ADMIN_ID:
+        return
     
-    await update.callback_query.answer()
+    text = " ".join(context.args)
+    if not text:
+        await update.message.reply_text('Использование: /search текст (можно "фраза" и -исключение)')
+        return
+    # Запрос нужен для листания: в callback_data он может не поместиться
+    context.user_data['search'] = text
+    page, keyboard = await render_search_page(text)
+    await update.message.reply_text(page, reply_markup=keyboard)
+
+
+async def search_page(update: Update, context):
+    query = update.callback_query
+    await query.answer()
+    text = context.user_data.get('search')
+    if update.effective_user.id != ADMIN_ID or not text:
+        return
+    
+    page, keyboard = await render_search_page(text, int(query.data.split(':')[1]))
+    await query.edit_message_text(page, reply_markup=keyboard)
+
+
+def _format_duration(seconds):
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} мин"
+    if seconds < 86400:
+        return f"{seconds / 3600:.1f} ч"
+    return f"{seconds / 86400:.1f} дн"
 
 
 async def show_stats(update: Update, context):
     if update.effective_user.id != ADMIN_ID:
         return
     
-    total = get_stats()
-    await context.bot.send_message(ADMIN_ID, f"📊 Статистика:\n\nРешено тикетов: {total}")
+    total = await get_stats()
+    rollup = await get_support_rollup(STATS_DAYS)
+    open_count, oldest = await get_backlog()
+    
+    lines = [f"📊 Статистика:\n\nРешено тикетов: {total}", f"Открыто сейчас: {open_count}"]
+    if oldest:
+        lines.append(f"Самый старый: {_format_duration((datetime.now() - oldest).total_seconds())}")
+    
+    per_day, per_priority = {}, {}
+    rated = rating_sum = 0
+    for r in rollup:
+        opened, resolved = per_day.get(r['day'], (0, 0))
+        per_day[r['day']] = (opened + r['opened'], resolved + r['resolved'])
+        count, seconds = per_priority.get(r['priority'], (0, 0))
+        per_priority[r['priority']] = (count + r['resolved'], seconds + r['resolution_seconds'])
+        rated += r['rated']
+        rating_sum += r['rating_sum']
+    
+    lines.append("\nПо дням (создано / решено):")
+    for day in sorted(per_day, reverse=True)[:7]:
+        lines.append(f"{day:%d.%m}: {per_day[day][0]} / {per_day[day][1]}")
+    lines.append(f"\nСреднее время решения ({STATS_DAYS} дн.):")
+    for priority in PRIORITIES.values():
+        count, seconds = per_priority.get(priority, (0, 0))
+        if count:
+            lines.append(f"{priority}: {_format_duration(seconds / count)} ({count})")
+    if rated:
+        lines.append(f"\nСредняя оценка: {rating_sum / rated:.1f} ({rated})")
+    
+    await context.bot.send_message(ADMIN_ID, "\n".join(lines))
     await update.callback_query.answer()
 
 
@@ -137,11 +306,11 @@ async def ticket_callback(update: Update, context):
     action, ticket_id = data[0], data[1]
     
     if action == "work":
-        update_ticket_status(ticket_id, STATUSES["progress"], update.effective_user.id)
+        await update_ticket_status(ticket_id, STATUSES["progress"], update.effective_user.id)
         await query.edit_message_text(f"Тикет #{ticket_id} взят в работу ⏳")
     
     elif action == "resolve":
-        resolve_ticket(ticket_id)
+        await resolve_ticket(ticket_id)
         await query.edit_message_text(f"Тикет #{ticket_id} решен ✅")
     
     elif action == "note":
@@ -157,7 +326,7 @@ async def add_note(update: Update, context):
     if not ticket_id:
         return ConversationHandler.END
     
-    add_ticket_note(ticket_id, update.message.text)
+    await add_ticket_note(ticket_id, update.message.text)
     await update.message.reply_text(f"Заметка добавлена к #{ticket_id} ✅")
     context.user_data.clear()
     return ConversationHandler.END
@@ -171,26 +340,47 @@ async def cancel(update: Update, context):
 
 def register_handlers(app):
     """Регистрация хендлеров"""
+    throttle.install(app, BOT_NAME)
     conv = ConversationHandler(
         entry_points=[MessageHandler(filters.TEXT & ~filters.COMMAND, create_ticket_start)],
         states={
             CHOOSE_PRIORITY: [CallbackQueryHandler(set_priority, pattern=r"^prio_")],
             ADD_NOTE: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_note)]
         },
-        fallbacks=[CommandHandler("cancel", cancel)]
+        fallbacks=[CommandHandler("cancel", cancel)],
+        # Недописанный тикет или заметка переживают перезапуск бота
+        name="support_ticket",
+        persistent=True
     )
     
     app.add_handler(conv)
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_command))
     app.add_handler(CallbackQueryHandler(ticket_callback, pattern=r"^(work|resolve|note)_"))
+    app.add_handler(CommandHandler("list", list_tickets))
     app.add_handler(CallbackQueryHandler(list_tickets, pattern="^list_tickets"))
+    app.add_handler(CallbackQueryHandler(browse_tickets, pattern=r"^(tp|tv):"))
+    app.add_handler(CommandHandler("search", search_command))
+    app.add_handler(CallbackQueryHandler(search_page, pattern=r"^sr:\d+$"))
     app.add_handler(CallbackQueryHandler(show_stats, pattern="^show_stats"))
 
 
+async def post_init(app):
+    """Фоновый перенос решённых тикетов в архив"""
+    archive.start()
+
+
+async def post_stop(app):
+    await archive.stop()
+
+
 def main():
     """Для автономного запуска"""
-    app = Application.builder().token(BOTS[BOT_NAME]).build()
+    app = (
+        Application.builder().token(BOTS[BOT_NAME])
+        .persistence(PostgresPersistence(BOT_NAME))
+        .post_init(post_init).post_stop(post_stop).post_shutdown(close_pool).build()
+    )
     register_handlers(app)
     logger.info("Support bot запущен")
     app.run_polling(allowed_updates=Update.ALL_TYPES)
@@ -0,0 +1,60 @@
+"""Ограничение входящих апдейтов: bucket на пользователя и общий bucket бота.
+При перегрузке первыми отбрасываются inline-запросы — они самые дешёвые для пользователя и повторяются при наборе."""
+import logging
+from telegram import Update
+from telegram.error import TelegramError
+from telegram.ext import ApplicationHandlerStop, TypeHandler
+from cache import LRUCache
+from config import (
+    ADMIN_ID, THROTTLE_USER_RATE, THROTTLE_USER_BURST, THROTTLE_INLINE_RATE, THROTTLE_INLINE_BURST,
+    THROTTLE_GLOBAL_RATE, THROTTLE_INLINE_RESERVE, THROTTLE_MAX_USERS
+)
+from ratelimit import TokenBucket
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# reason: user — превышен лимит пользователя, global — общий лимит бота, shed — inline при перегрузке
+throttled = metrics.Counter("bot_updates_throttled", "Апдейты, отброшенные ограничением", ("bot", "reason"))
+
+
+class Throttle:
+    def __init__(self, bot):
+        self.bot = bot
+        self.bucket = TokenBucket(THROTTLE_GLOBAL_RATE)
+        # Простоявший bucket заполнен до краёв, как новый, поэтому вытеснение по LRU ничего не теряет
+        self._users = LRUCache(THROTTLE_MAX_USERS)
+
+    async def _drop(self, update, reason):
+        throttled.inc(self.bot, reason)
+        if update.callback_query is not None:
+            # Без ответа клиент крутит индикатор загрузки на кнопке до таймаута
+            try:
+                await update.callback_query.answer()
+            except TelegramError as e:
+                logger.warning(f"⚠️ {self.bot}: не удалось ответить на отброшенный callback: {e}")
+        raise ApplicationHandlerStop
+
+    async def check(self, update, context):
+        user = update.effective_user
+        if user is not None and user.id == ADMIN_ID:
+            return
+        inline = update.inline_query is not None
+        if user is not None:
+            key = (user.id, inline)
+            bucket = self._users.get(key)
+            if bucket is None:
+                bucket = TokenBucket(*((THROTTLE_INLINE_RATE, THROTTLE_INLINE_BURST) if inline
+                                       else (THROTTLE_USER_RATE, THROTTLE_USER_BURST)))
+                self._users.set(key, bucket)
+            if not bucket.try_acquire():
+                await self._drop(update, "user")
+        # Inline-запросам доступна только часть общего запаса: остаток бережётся для сообщений и кнопок
+        keep = self.bucket.capacity * THROTTLE_INLINE_RESERVE if inline else 0
+        if not self.bucket.try_acquire(keep):
+            await self._drop(update, "shed" if inline else "global")
+
+
+def install(app, bot):
+    """Ограничение раньше всех обработчиков бота (группа -1); отброшенный апдейт дальше не идёт"""
+    app.add_handler(TypeHandler(Update, Throttle(bot).check), group=-1)
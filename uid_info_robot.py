@@ -5,13 +5,20 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, InlineQueryHandler, filters
 from telegram.error import BadRequest
 from config import BOTS
-from database import add_uid_request, get_user_requests_count
+from database import add_uid_request, get_user_requests_count, close_pool
+from username_cache import resolve_username, warm_up
+import media
+import throttle
+from inline import Debouncer, SUPERSEDED, answer
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+IMAGE_URL = "https://www.darkheavens.ru/e5d8a8cf9640c657f9daae6587e33d94.jpg"
 BOT_NAME = "uid_info"
 
+debouncer = Debouncer()
+
 
 async def start(update: Update, context):
     keyboard = InlineKeyboardMarkup([
@@ -27,8 +34,8 @@ async def start(update: Update, context):
     )
     
     try:
-        await update.message.reply_photo(
-            photo="https://www.darkheavens.ru/e5d8a8cf9640c657f9daae6587e33d94.jpg",
+        await media.send_photo(
+            context.bot, update.effective_chat.id, IMAGE_URL,
             caption=text,
             reply_markup=keyboard,
             parse_mode='Markdown'
@@ -45,10 +52,9 @@ async def handle_username(update: Update, context):
         return
     
     try:
-        chat = await context.bot.get_chat(username)
-        user_id = chat.id
+        user_id = await resolve_username(context.bot, username)
         
-        add_uid_request(update.effective_user.id, username, user_id)
+        await add_uid_request(update.effective_user.id, username, user_id)
         
         await update.message.reply_text(
             f"ID пользователя {username}: `{user_id}`",
@@ -57,6 +63,7 @@ async def handle_username(update: Update, context):
         logger.info(f"Запрос ID для {username} от пользователя {update.effective_user.id}")
         
     except BadRequest as e:
+        await add_uid_request(update.effective_user.id, username, None)
         await update.message.reply_text(f"Не удалось найти пользователя {username} 😔\nОшибка: {e}")
     except Exception as e:
         await update.message.reply_text(f"Произошла ошибка: {e}")
@@ -72,14 +79,16 @@ async def inline_query(update: Update, context):
             'input_message_content': {'message_text': "Используйте: @uid_info_robot @username"},
             'description': "Например: @uid_info_robot @telegram"
         }]
-        await update.answer(results)
+        await answer(update.inline_query, results, hint=True)
         return
     
     try:
-        chat = await context.bot.get_chat(query)
-        user_id = chat.id
+        # Telegram шлёт запрос на каждое нажатие — выполняем только последний
+        user_id = await debouncer.run(update.effective_user.id, lambda: resolve_username(context.bot, query))
+        if user_id is SUPERSEDED:
+            return
         
-        add_uid_request(update.effective_user.id, query, user_id)
+        await add_uid_request(update.effective_user.id, query, user_id)
         
         results = [{
             'type': 'article', 'id': uuid4().hex,
@@ -87,7 +96,7 @@ async def inline_query(update: Update, context):
             'input_message_content': {'message_text': f"ID пользователя {query}: `{user_id}`"},
             'description': f"Нажмите чтобы отправить ID"
         }]
-        await update.answer(results, cache_time=0)
+        await answer(update.inline_query, results)
         
     except Exception as e:
         results = [{
@@ -96,19 +105,25 @@ async def inline_query(update: Update, context):
             'input_message_content': {'message_text': f"Не удалось найти пользователя {query}"},
             'description': str(e)
         }]
-        await update.answer(results)
+        await answer(update.inline_query, results, cache_time=10)
+
+
+async def post_init(app):
+    """Прогрев кэша username при старте"""
+    await warm_up()
 
 
 def register_handlers(app):
     """Регистрация хендлеров"""
+    throttle.install(app, BOT_NAME)
     app.add_handler(CommandHandler('start', start))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_username))
-    app.add_handler(InlineQueryHandler(inline_query))
+    app.add_handler(InlineQueryHandler(inline_query, block=False))
 
 
 def main():
     """Для автономного запуска"""
-    app = Application.builder().token(BOTS[BOT_NAME]).build()
+    app = Application.builder().token(BOTS[BOT_NAME]).post_init(post_init).post_shutdown(close_pool).build()
     register_handlers(app)
     logger.info("UID Info bot запущен")
     app.run_polling(allowed_updates=Update.ALL_TYPES)
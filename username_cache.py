@@ -0,0 +1,49 @@
+"""Кэш username -> ID для uid_info бота с отрицательным кэшированием"""
+import logging
+from telegram.error import BadRequest
+from cache import TTLCache
+from config import USERNAME_CACHE_SIZE, USERNAME_CACHE_TTL, USERNAME_NEGATIVE_TTL
+from database import get_recent_resolutions
+from inline import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Значение — ID пользователя, либо строка с текстом ошибки для "не найден"
+cache = TTLCache(USERNAME_CACHE_SIZE, USERNAME_CACHE_TTL)
+_flight = SingleFlight()
+
+
+async def warm_up():
+    """Загрузить свежие результаты из uid_requests (они же служат персистентным слоем кэша)"""
+    rows = await get_recent_resolutions(USERNAME_CACHE_TTL, USERNAME_CACHE_SIZE)
+    loaded = 0
+    for username, target_id, age in reversed(rows):
+        if target_id is not None:
+            cache.set(username, target_id, ttl=USERNAME_CACHE_TTL - age)
+            loaded += 1
+        elif age < USERNAME_NEGATIVE_TTL:
+            cache.set(username, "Chat not found", ttl=USERNAME_NEGATIVE_TTL - age)
+            loaded += 1
+    logger.info(f"✅ Кэш username прогрет: {loaded} записей")
+
+
+async def resolve_username(bot, username):
+    """ID по username: из кэша, иначе через get_chat (одновременные запросы одного username — один вызов).
+    "Не найден" кэшируется отдельно и короче."""
+    key = username.lower()
+    cached = cache.get(key)
+    if isinstance(cached, str):
+        raise BadRequest(cached)
+    if cached is not None:
+        return cached
+    return await _flight.do(key, lambda: _fetch(bot, username, key))
+
+
+async def _fetch(bot, username, key):
+    try:
+        chat = await bot.get_chat(username)
+    except BadRequest as e:
+        cache.set(key, e.message, ttl=USERNAME_NEGATIVE_TTL)
+        raise
+    cache.set(key, chat.id)
+    return chat.id
@@ -0,0 +1,115 @@
+"""Write-behind буфер: копит строки аналитики в памяти и пишет их в БД пачками"""
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    """Ограниченная очередь строк с фоновым сбросом по размеру пачки или по таймеру.
+
+    flush_func(rows) должна записать пачку за один round-trip (COPY / multi-row INSERT).
+    Если БД недоступна, пачка повторяется с экспоненциальной задержкой, очередь
+    заполняется до max_pending и put() начинает ждать (backpressure); строка, которую
+    не удалось поставить за put_timeout, отбрасывается и учитывается в stats.
+    """
+
+    def __init__(self, name, flush_func, max_batch=500, flush_interval=2.0,
+                 max_pending=10000, put_timeout=5.0, max_retry_delay=30.0):
+        self.name = name
+        self._flush_func = flush_func
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_retry_delay = max_retry_delay
+        self._queue = asyncio.Queue(maxsize=max_pending)
+        self._task = None
+        self._inflight = []
+        self._closing = False
+        self.stats = {"enqueued": 0, "flushed": 0, "batches": 0, "dropped": 0, "errors": 0}
+
+    def _ensure_started(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name=f"write-buffer-{self.name}")
+
+    async def put(self, row):
+        """Поставить строку в очередь; ждёт не дольше put_timeout, если буфер полон"""
+        if self._closing:
+            await self._flush_with_retry([row], attempts=1)
+            return
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(row)
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(self._queue.put(row), self.put_timeout)
+            except asyncio.TimeoutError:
+                self.stats["dropped"] += 1
+                logger.warning(f"⚠️ {self.name}: буфер переполнен, строка отброшена")
+                return
+        self.stats["enqueued"] += 1
+
+    def _drain(self, batch):
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._inflight = batch = [await self._queue.get()]
+            deadline = loop.time() + self.flush_interval
+            self._drain(batch)
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+                self._drain(batch)
+            await self._flush_with_retry(batch)
+            self._inflight = []
+
+    async def _flush_with_retry(self, batch, attempts=None):
+        delay = 1.0
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                await self._flush_func(batch)
+                self.stats["flushed"] += len(batch)
+                self.stats["batches"] += 1
+                return True
+            except Exception as e:
+                self.stats["errors"] += 1
+                if attempts is not None and attempt >= attempts:
+                    self.stats["dropped"] += len(batch)
+                    logger.error(f"❌ {self.name}: не удалось записать {len(batch)} строк: {e}")
+                    return False
+                logger.warning(f"⚠️ {self.name}: ошибка записи пачки ({e}), повтор через {delay:.0f} сек...")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+
+    def pending(self):
+        """Число строк, ожидающих записи"""
+        return self._queue.qsize() + len(self._inflight)
+
+    async def close(self, attempts=3):
+        """Остановить фоновый сброс и записать всё, что осталось в очереди"""
+        self._closing = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        batch, self._inflight = self._inflight, []
+        while batch or not self._queue.empty():
+            self._drain(batch)
+            await self._flush_with_retry(batch, attempts=attempts)
+            batch = []